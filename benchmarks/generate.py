@@ -0,0 +1,100 @@
+import os
+import random
+import subprocess
+
+FILES_PER_DIRECTORY = 100
+AUTHOR = {
+    'GIT_AUTHOR_NAME': 'Benchmark',
+    'GIT_AUTHOR_EMAIL': 'benchmark@example.com',
+    'GIT_AUTHOR_DATE': '1600000000 +0000',
+    'GIT_COMMITTER_NAME': 'Benchmark',
+    'GIT_COMMITTER_EMAIL': 'benchmark@example.com',
+    'GIT_COMMITTER_DATE': '1600000000 +0000'
+}
+
+
+class RepositoryGenerator:
+
+    def __init__(self, directory, files=1000, modified=100, untracked=100, branches=50, remotes=2, max_divergence=5, seed=0):
+        super().__init__()
+        self.directory = directory
+        self.files = files
+        self.modified = modified
+        self.untracked = untracked
+        self.branches = branches
+        self.remotes = max(1, remotes)
+        self.max_divergence = max_divergence
+        self.random = random.Random(seed)
+        self.environment = dict(os.environ, **AUTHOR)
+
+    def parameters(self):
+        return {
+            'files': self.files,
+            'modified': self.modified,
+            'untracked': self.untracked,
+            'branches': self.branches,
+            'remotes': self.remotes,
+            'max_divergence': self.max_divergence
+        }
+
+    def git(self, *args, input=None):
+        result = subprocess.run(
+            ['git'] + list(args), cwd=self.directory, env=self.environment, input=input,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True
+        )
+        return result.stdout.decode().strip()
+
+    def tracked_path(self, i):
+        return os.path.join('dir{:04d}'.format(i // FILES_PER_DIRECTORY), 'file{:06d}.txt'.format(i))
+
+    def write(self, relative_path, content):
+        path = os.path.join(self.directory, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'a') as file:
+            file.write(content)
+
+    def commit_chain(self, tree, parent, length, message):
+        sha = parent
+        for i in range(length):
+            sha = self.git('commit-tree', tree, '-p', sha, '-m', '{} {}'.format(message, i))
+        return sha
+
+    def generate(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.git('init', '-q')
+
+        for i in range(self.files):
+            self.write(self.tracked_path(i), 'line {}\n'.format(i))
+        self.git('add', '-A')
+        self.git('commit', '-q', '-m', 'Initial commit')
+
+        base = self.git('rev-parse', 'HEAD')
+        tree = self.git('rev-parse', 'HEAD^{tree}')
+
+        config = []
+        updates = []
+        for r in range(self.remotes):
+            remote = 'remote{}'.format(r)
+            config.append('[remote "{0}"]\n\turl = ../{0}.git\n\tfetch = +refs/heads/*:refs/remotes/{0}/*\n'.format(remote))
+
+        for b in range(self.branches):
+            name = 'feature/BENCH-{}-branch'.format(b)
+            remote = 'remote{}'.format(b % self.remotes)
+            ahead = self.random.randint(0, self.max_divergence)
+            behind = self.random.randint(0, self.max_divergence)
+
+            updates.append('update refs/heads/{} {}\n'.format(name, self.commit_chain(tree, base, ahead, name)))
+            updates.append('update refs/remotes/{}/{} {}\n'.format(remote, name, self.commit_chain(tree, base, behind, remote + '/' + name)))
+            config.append('[branch "{}"]\n\tremote = {}\n\tmerge = refs/heads/{}\n'.format(name, remote, name))
+
+        self.git('update-ref', '--stdin', input=''.join(updates).encode())
+        with open(os.path.join(self.directory, '.git', 'config'), 'a') as file:
+            file.write(''.join(config))
+
+        for i in self.random.sample(range(self.files), min(self.modified, self.files)):
+            self.write(self.tracked_path(i), 'modified\n')
+
+        for i in range(self.untracked):
+            self.write(os.path.join('untracked', 'new{:06d}.txt'.format(i)), 'untracked {}\n'.format(i))
+
+        return self.directory
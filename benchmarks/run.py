@@ -0,0 +1,207 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from unittest import mock
+
+from benchmarks.generate import RepositoryGenerator
+
+VISIBLE_ROWS = 60
+ROW_WIDTH = 120
+DEFAULT_THRESHOLD = 1.2
+
+
+def measure(function, repeat):
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        runs.append(time.perf_counter() - start)
+
+    return {'min': min(runs), 'median': statistics.median(runs), 'runs': runs}
+
+
+def build_rows(delegate, rows):
+    for i in range(rows):
+        delegate.build_row(i, delegate.get_data(i), i == 0, ROW_WIDTH)
+
+
+def scroll_rows(delegate, rows):
+    for selected in range(rows):
+        for i in range(rows):
+            delegate.build_row(i, delegate.get_data(i), i == selected, ROW_WIDTH)
+
+
+def type_filter(ui, text):
+    for length in range(1, len(text) + 1):
+        ui.setFilter(text[:length])
+    for length in range(len(text) - 1, -1, -1):
+        ui.setFilter(text[:length])
+
+
+def benchmark_repository(directory, repeat):
+    from utils.git import Stage, Branch
+
+    results = {}
+    stage = Stage(directory)
+    results['stage.status'] = measure(stage.status, repeat)
+
+    cache = os.path.join(stage.common_dir, 'git-toolbox')
+    def cold_branches():
+        shutil.rmtree(cache, ignore_errors=True)
+        Stage(directory).getBranches(local=True, remotes=True)
+
+    results['repository.getBranches.cold'] = measure(cold_branches, repeat)
+    results['repository.getBranches.warm'] = measure(lambda: stage.getBranches(local=True, remotes=True), repeat)
+
+    records = [branch.to_record() for branch in stage.getBranches(local=True, remotes=True)]
+    results['branch.construction'] = measure(lambda: [Branch.from_record(stage, record) for record in records], repeat)
+    stage.close()
+
+    return results
+
+
+def benchmark_ui(directory, repeat):
+    # the delegates only need color pairs from curses, everything else renders into gupy views
+    with mock.patch('curses.color_pair', return_value=0):
+        import branches
+        import stage
+        from utils.git import Stage, Repository
+
+        results = {}
+
+        repository = Repository(directory)
+        ui = branches.UI(repository, False)
+        ui.toggleLocalOnly()
+        while ui.hasPendingDiffs():
+            time.sleep(0.01)
+        name = ui.get_data(ui.number_of_rows() // 2).head if ui.number_of_rows() else ''
+        results['branches.applyFilter'] = measure(lambda: type_filter(ui, name), repeat)
+        results['branches.sort'] = measure(ui.toggleSortOrder, repeat)
+
+        rows = min(VISIBLE_ROWS, ui.number_of_rows())
+        results['branches.build_row.scroll'] = measure(lambda: scroll_rows(ui, rows), repeat)
+        ui.cancelDiffJobs()
+        ui.cancelFetchJobs()
+        repository.close()
+
+        delegate = stage.TableViewDelegate({change_type: 0 for change_type in 'ADRMTC?'})
+        delegate.files = Stage(directory).status()
+        rows = min(VISIBLE_ROWS, delegate.number_of_rows())
+
+        def cold_rows():
+            delegate.row_cache.clear()
+            build_rows(delegate, rows)
+
+        results['stage.build_row.cold'] = measure(cold_rows, repeat)
+        results['stage.build_row.scroll'] = measure(lambda: scroll_rows(delegate, rows), repeat)
+
+    return results
+
+
+def compare(results, baseline, threshold):
+    comparison = {}
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous or not previous['median']:
+            continue
+
+        ratio = result['median'] / previous['median']
+        comparison[name] = ratio
+        if ratio > threshold:
+            regressions.append(name)
+
+    return comparison, regressions
+
+
+def git_version():
+    return subprocess.run(['git', '--version'], stdout=subprocess.PIPE).stdout.decode().strip()
+
+
+def parse_arguments():
+    argparser = argparse.ArgumentParser(
+        prog='benchmarks',
+        description='Generates a synthetic repository and times status, branch listing, filtering and row building.'
+    )
+    argparser.add_argument('-n', '--files', help="Number of tracked files", type=int, default=1000)
+    argparser.add_argument('-m', '--modified', help="Number of modified tracked files", type=int, default=100)
+    argparser.add_argument('-k', '--untracked', help="Number of untracked files", type=int, default=100)
+    argparser.add_argument('-b', '--branches', help="Number of local branches with upstreams", type=int, default=50)
+    argparser.add_argument('-r', '--remotes', help="Number of remotes", type=int, default=2)
+    argparser.add_argument('-d', '--max-divergence', help="Maximum number of commits a branch is ahead or behind", type=int, default=5)
+    argparser.add_argument('-s', '--seed', help="Seed for the generated repository", type=int, default=0)
+    argparser.add_argument('--repeat', help="Number of runs per measurement", type=int, default=5)
+    argparser.add_argument('--repository', help="Use or create the synthetic repository in this directory instead of a temporary one")
+    argparser.add_argument('--no-ui', help="Skip the benchmarks that need the curses front-ends", action="store_true")
+    argparser.add_argument('-o', '--output', help="Write the results as JSON to this file instead of stdout")
+    argparser.add_argument('--baseline', help="JSON results of an earlier run to compare against")
+    argparser.add_argument(
+        '--threshold',
+        help="Median ratio against the baseline above which a measurement counts as a regression. Defaults to {}.".format(DEFAULT_THRESHOLD),
+        type=float,
+        default=DEFAULT_THRESHOLD
+    )
+    return argparser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+
+    temporary = None
+    directory = args.repository
+    if directory is None:
+        temporary = tempfile.mkdtemp(prefix='git-toolbox-benchmark-')
+        directory = os.path.join(temporary, 'repository')
+
+    generator = RepositoryGenerator(
+        directory, args.files, args.modified, args.untracked, args.branches, args.remotes, args.max_divergence, args.seed
+    )
+
+    try:
+        if not os.path.isdir(os.path.join(directory, '.git')):
+            start = time.perf_counter()
+            generator.generate()
+            print('Generated repository in {:.1f}s'.format(time.perf_counter() - start), file=sys.stderr)
+
+        results = benchmark_repository(directory, args.repeat)
+        if not args.no_ui:
+            results.update(benchmark_ui(directory, args.repeat))
+    finally:
+        if temporary:
+            shutil.rmtree(temporary, ignore_errors=True)
+
+    report = {
+        'parameters': dict(generator.parameters(), seed=args.seed, repeat=args.repeat),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'git': git_version()
+        },
+        'results': results
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as file:
+            comparison, regressions = compare(results, json.load(file), args.threshold)
+        report['baseline'] = {'file': args.baseline, 'ratios': comparison, 'regressions': regressions}
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output + '\n')
+    else:
+        print(output)
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,12 +4,27 @@ import curses
 import sys
 import subprocess
 import time
-from utils.git import Repository
+from concurrent.futures import ThreadPoolExecutor
+from operator import attrgetter
+from utils.fuzzy import FuzzyIndex
+from utils.git import Repository, failedRemotes, FETCH_JOBS
+from utils.input import pending_keys as pendingKeys
+from utils.output import write_records
+from utils.rowcache import RowCache
 from gupy.view import Label, HBox, BackgroundView, ListView, ListViewDelegate, ListViewDataSource, View
 from gupy.geometry import Padding
 from gupy.screen import ConstrainedBasedScreen
 from pathlib import Path
-from git import GitCommandError
+from utils.lazy import lazy_import
+from utils import trace
+
+git = lazy_import('git')
+
+DIFF_WORKERS = 4
+DIFF_CHUNK_SIZE = 16
+PREFETCH_ROWS = 30
+DIFF_PLACEHOLDER = '…'
+POLL_INTERVAL = 100
 
 def shortenPath(path):
     try:
@@ -56,6 +71,11 @@ class Colorpairs:
     VIEW = 13
     UPSTREAM = 14
 
+class FetchState:
+    RUNNING = ' … '
+    DONE = ' ✓ '
+    FAILED = ' ✗ '
+
 class Legends:
 
     @staticmethod
@@ -101,6 +121,10 @@ class Legends:
 
         return result
 
+    @staticmethod
+    def fetch(states):
+        return [('[{}]'.format(name), state) for name, state in states.items()]
+
     FILTER = [
         ('[ENTER]', ' Quit and save Filter '),
         ('[ESC]', ' Quit and clear Filter ')
@@ -108,7 +132,7 @@ class Legends:
 
 class UI(ListViewDelegate, ListViewDataSource):
 
-    def __init__(self, repo, keepOpen):
+    def __init__(self, repo, keepOpen, fetchJobs=FETCH_JOBS):
         self.errorMessage = None
         self.__repo = repo
         self.__filter = ''
@@ -117,19 +141,138 @@ class UI(ListViewDelegate, ListViewDataSource):
         self.__keepOpen = keepOpen
         self.isFiltering = False
         self.__showUpstreams = True
+        self.__diffPool = ThreadPoolExecutor(max_workers=DIFF_WORKERS)
+        self.__diffJobs = []
+        self.__diffGeneration = 0
+        self.__scheduled = set()
+        self.__rowCache = RowCache()
+        self.__fetchPool = ThreadPoolExecutor(max_workers=1)
+        self.__fetchJobCount = fetchJobs
+        self.__fetchJobs = []
+        self.__fetchStates = {}
+        self.__headerState = None
+        self.__legend = None
+        self.__dirty = True
+        self.__activeBranchName = self.activeBranchName()
         self.refreshList()
 
+    def activeBranchName(self):
+        return None if self.__repo.hasDetachedHead() else self.__repo.active_branch_name()
+
     def refreshList(self):
-        self.__branches = self.__repo.getBranches(local=self.__onlyLocal, remotes=not self.__onlyLocal)
-        self.__filteredBranches = self.__branches
-        remotes = self.__repo.remotes()
-        self.__maxRemoteNameLength = max([len(remote.name) for remote in remotes]) if len(remotes) else 0
-        self.sort()
+        self.cancelDiffJobs()
+        self.__rowCache.clear()
+        branches = self.__repo.getBranches(local=self.__onlyLocal, remotes=not self.__onlyLocal, withDiffs=False)
+        self.setBranches(branches)
+
+    def setBranches(self, branches):
+        self.__branches = sorted(branches, key=attrgetter('sortKey'))
+        self.__filterIndex = FuzzyIndex(self.__branches, lambda branch: branch.head)
+        remotes = self.__repo.remoteNames()
+        self.__maxRemoteNameLength = max([len(remote) for remote in remotes]) if len(remotes) else 0
         self.applyFilter()
 
+    def mergeBranches(self):
+        known = {branch.refname: branch for branch in self.__branches}
+        branches = []
+        current = self.__repo.getBranches(local=self.__onlyLocal, remotes=not self.__onlyLocal, withDiffs=False)
+        self.__repo.resolveUpstreams(current)
+        for branch in current:
+            previous = known.get(branch.refname)
+            if previous and (previous.sha, previous.upstream, previous.upstreamSha) == (branch.sha, branch.upstream, branch.upstreamSha):
+                branches.append(previous)
+            else:
+                branches.append(branch)
+                self.__scheduled.discard(branch.refname)
+
+        self.setBranches(branches)
+
+    def prefetchDiffs(self, i):
+        window = self.__filteredBranches[max(0, i - PREFETCH_ROWS):i + PREFETCH_ROWS + 1]
+        self.scheduleDiffJobs([branch for branch in window if branch.pending and branch.refname not in self.__scheduled])
+
+    def scheduleDiffJobs(self, branches):
+        generation = self.__diffGeneration
+
+        for start in range(0, len(branches), DIFF_CHUNK_SIZE):
+            chunk = branches[start:start + DIFF_CHUNK_SIZE]
+            self.__scheduled.update(branch.refname for branch in chunk)
+            future = self.__diffPool.submit(self.__repo.materialize, chunk)
+            future.add_done_callback(lambda future, chunk=chunk: self.applyDiffs(future, chunk, generation))
+            self.__diffJobs.append(future)
+
+    def applyDiffs(self, future, chunk, generation):
+        if future.cancelled() or generation != self.__diffGeneration:
+            return
+
+        if future.exception():
+            for branch in chunk:
+                if branch.pending:
+                    branch.setDiff(None, None)
+        self.__dirty = True
+
+    def cancelDiffJobs(self):
+        self.__diffGeneration += 1
+        for future in self.__diffJobs:
+            future.cancel()
+
+        self.__diffJobs = []
+        self.__scheduled = set()
+
+    def hasPendingDiffs(self):
+        self.__diffJobs = [future for future in self.__diffJobs if not future.done()]
+        return len(self.__diffJobs) > 0
+
     def fetchAll(self):
-        self.__repo.fetch()
-        self.refreshList()
+        if self.isFetching():
+            return
+
+        names = self.__repo.remoteNames()
+        if not names:
+            return
+
+        # git fetches the remotes in parallel itself and updates the refs one remote at a time
+        self.__fetchStates = {name: FetchState.RUNNING for name in names}
+        future = self.__fetchPool.submit(self.__repo.fetchRemotes, names, self.__fetchJobCount, self.fetchFailed)
+        future.add_done_callback(lambda future: self.fetchFinished(future, names))
+        self.__fetchJobs = [future]
+
+    def fetchFailed(self, name):
+        if name in self.__fetchStates:
+            self.__fetchStates[name] = FetchState.FAILED
+            self.__dirty = True
+
+    def fetchFinished(self, future, names):
+        if future.cancelled():
+            return
+
+        failed = set()
+        error = future.exception()
+        if error:
+            stderr = error.stderr if isinstance(error, git.GitCommandError) else str(error)
+            failed = set(failedRemotes(stderr)) or set(names)
+            failedNames = ', '.join('\'{}\''.format(name) for name in names if name in failed)
+            self.errorMessage = 'error: Fetching {} failed.\n{}'.format(failedNames, stderr)
+
+        for name in names:
+            self.__fetchStates[name] = FetchState.FAILED if name in failed else FetchState.DONE
+        self.__dirty = True
+
+    def isFetching(self):
+        return any(not future.done() for future in self.__fetchJobs)
+
+    def checkFetch(self):
+        if self.__fetchJobs and not self.isFetching():
+            self.__fetchJobs = []
+            if FetchState.FAILED not in self.__fetchStates.values():
+                self.__fetchStates = {}
+            self.mergeBranches()
+
+    def cancelFetchJobs(self):
+        for future in self.__fetchJobs:
+            future.cancel()
+
+        self.__fetchPool.shutdown(wait=False)
 
     def setupColors(self):
         curses.curs_set(0)
@@ -207,7 +350,7 @@ class UI(ListViewDelegate, ListViewDataSource):
         directoryLabel.attributes.append(curses.A_BOLD)
         title_hbox.add_view(directoryLabel, Padding(0, 0, 0, 0))
 
-        activeBranchLabel = Label('[' + self.__repo.active_branch_name() + ']')
+        activeBranchLabel = Label('[{}]'.format(self.__activeBranchName or 'detached HEAD'))
         activeBranchLabel.attributes.append(curses.color_pair(Colorpairs.PATTERN))
         activeBranchLabel.attributes.append(curses.A_BOLD)
         title_hbox.add_view(activeBranchLabel, Padding(1, 0, 0, 0))
@@ -223,6 +366,12 @@ class UI(ListViewDelegate, ListViewDataSource):
         return (title_hbox, directoryLabel, activeBranchLabel, viewLabel)
 
     def updateHeaderBox(self, screen, filterElements):
+        self.__activeBranchName = self.activeBranchName()
+        state = (self.__filter, self.isFiltering, self.__onlyLocal, self.__activeBranchName)
+        if state == self.__headerState:
+            return False
+
+        self.__headerState = state
         _, _, filterCriteriaLabel, filterLabel = filterElements
 
         filterLabel.text = self.__filter
@@ -245,6 +394,8 @@ class UI(ListViewDelegate, ListViewDataSource):
         else:
             self.titleElements = []
 
+        return True
+
     def addListView(self, screen):
         listView = ListView(self, self)
         screen.add_view(listView, lambda w, h, v: (0, 1, w, h-2))
@@ -297,7 +448,7 @@ class UI(ListViewDelegate, ListViewDataSource):
 
     def performMerge(self, branch):
         branchName = '{}/{}'.format(branch.remote, branch.head) if branch.remote else branch.head
-        activeBranchName = self.__repo.active_branch_name()
+        activeBranchName = self.activeBranchName()
 
         if branch.head == activeBranchName:
 
@@ -318,15 +469,20 @@ class UI(ListViewDelegate, ListViewDataSource):
         self.applyComfirmedAction(screen, lambda: self.performMerge(branch), 'Do you want to merge the selected branch into your active?')
 
     def updateLegend(self, screen):
-        screen.remove_views(self.legendElements)
-
         if self.isFiltering:
             legend = Legends.FILTER
         else:
             hasFilter = self.__filter and len(self.__filter)
             legend = Legends.main(self.__onlyLocal, hasFilter, self.__showUpstreams, self.__sortDescending)
+            legend = Legends.fetch(self.__fetchStates) + legend
+
+        if legend == self.__legend:
+            return False
 
+        screen.remove_views(self.legendElements)
         self.legendElements = self.addLegend(screen, legend)
+        self.__legend = legend
+        return True
 
     def deleteBranchConfirmed(self, screen, branch):
         text = 'Do you really want to delete the selected branch?'
@@ -339,9 +495,9 @@ class UI(ListViewDelegate, ListViewDataSource):
             return
 
         try:
-            self.errorMessage = self.__repo.repo.git.branch('-d', branch.head)
+            self.errorMessage = self.__repo.deleteBranch(branch.head)
             self.refreshList()
-        except GitCommandError as e:
+        except git.GitCommandError as e:
             self.errorMessage = e.stderr
             self.stopLoop()
 
@@ -353,6 +509,8 @@ class UI(ListViewDelegate, ListViewDataSource):
         screen = ConstrainedBasedScreen(stdscr)
         self.titleElements = []
         self.legendElements = []
+        self.__headerState = None
+        self.__legend = None
         headerElements = self.addHeaderBox(screen)
         listView = self.addListView(screen)
 
@@ -360,102 +518,118 @@ class UI(ListViewDelegate, ListViewDataSource):
         self.confirmationYesSelected = False
         self.confirmationAction = None
 
+        self.__dirty = True
         while self.__loopRunning:
-            self.updateHeaderBox(screen, headerElements)
-            if not self.confirmationActive:
-                self.updateLegend(screen)
+            self.checkFetch()
+            if self.updateHeaderBox(screen, headerElements):
+                self.__dirty = True
+            if not self.confirmationActive and self.updateLegend(screen):
+                self.__dirty = True
+
+            if self.__dirty:
+                self.__dirty = False
+                with trace.span('render', 'ui'):
+                    screen.render()
+
+            stdscr.timeout(POLL_INTERVAL if self.hasPendingDiffs() or self.isFetching() else -1)
+            key = stdscr.getch()
 
-            screen.render()
+            # all keys that arrived while rendering are handled before the next render
+            for key in pendingKeys(stdscr, key):
+                self.__dirty = True
+                if key == curses.KEY_RESIZE or not self.__loopRunning:
+                    continue
 
-            key = stdscr.getch()
-            if key == curses.KEY_RESIZE:
-                continue
+                with trace.span('input', 'ui', key=key):
+                    if self.confirmationActive:
+                        if key == Keys.LEFT:
+                            self.confirmationYesSelected = False
+                            self.updateConfirmationLabels()
 
-            if self.confirmationActive:
-                if key == Keys.LEFT:
-                    self.confirmationYesSelected = False
-                    self.updateConfirmationLabels()
+                        elif key == Keys.RIGHT:
+                            self.confirmationYesSelected = True
+                            self.updateConfirmationLabels()
 
-                elif key == Keys.RIGHT:
-                    self.confirmationYesSelected = True
-                    self.updateConfirmationLabels()
+                        elif key == Keys.ENTER:
+                            self.hideConfirmation(screen)
+                            if self.confirmationYesSelected and self.confirmationAction is not None:
+                                self.confirmationAction()
 
-                elif key == Keys.ENTER:
-                    self.hideConfirmation(screen)
-                    if self.confirmationYesSelected and self.confirmationAction is not None:
-                        self.confirmationAction()
+                    elif self.isFiltering:
+                        if key == Keys.ESCAPE:
+                            self.isFiltering = False
+                            self.setFilter('')
 
-            elif self.isFiltering:
-                if key == Keys.ESCAPE:
-                    self.isFiltering = False
-                    self.setFilter('')
+                        elif key == Keys.ENTER:
+                            self.isFiltering = False
+                            if len(self.getFilter()) == 0:
+                                self.clearFilter()
 
-                elif key == Keys.ENTER:
-                    self.isFiltering = False
-                    if len(self.getFilter()) == 0:
-                        self.clearFilter()
+                        elif key == Keys.BACKSPACE:
+                            self.setFilter(self.getFilter()[:-1])
 
-                elif key == Keys.BACKSPACE:
-                    self.setFilter(self.getFilter()[:-1])
+                        elif key in [Keys.LEFT, Keys.RIGHT, Keys.UP, Keys.DOWN]:
+                            pass
 
-                elif key in [Keys.LEFT, Keys.RIGHT, Keys.UP, Keys.DOWN]:
-                    pass
+                        else:
+                            character = chr(key)
+                            self.setFilter(self.getFilter() + character)
 
-                else:
-                    character = chr(key)
-                    self.setFilter(self.getFilter() + character)
+                    else:
+                        selectedIndex = listView.get_selected_row_index()
+                        branch = self.__filteredBranches[selectedIndex] if selectedIndex < len(self.__filteredBranches) else None
 
-            else:
-                selectedIndex = listView.get_selected_row_index()
-                branch = self.__filteredBranches[selectedIndex] if selectedIndex < len(self.__filteredBranches) else None
+                        if key == Keys.ENTER and branch:
+                            self.checkoutSelectedBranch(screen, branch)
 
-                if key == Keys.ENTER and branch:
-                    self.checkoutSelectedBranch(screen, branch)
+                        if key == Keys.F:
+                            self.isFiltering = True
 
-                if key == Keys.F:
-                    self.isFiltering = True
+                        if key == Keys.UP:
+                            listView.select_previous()
 
-                if key == Keys.UP:
-                    listView.select_previous()
+                        if key == Keys.DOWN:
+                            listView.select_next()
 
-                if key == Keys.DOWN:
-                    listView.select_next()
+                        if key == Keys.T and branch:
+                            if branch.remote:
+                                self.trackRemoteBranch(branch)
 
-                if key == Keys.T and branch:
-                    if branch.remote:
-                        self.trackRemoteBranch(branch)
+                        if key == Keys.C:
+                            self.clearFilter()
 
-                if key == Keys.C:
-                    self.clearFilter()
+                        if key == Keys.L:
+                            self.toggleLocalOnly()
 
-                if key == Keys.L:
-                    self.toggleLocalOnly()
+                        if key == Keys.S:
+                            self.toggleSortOrder()
 
-                if key == Keys.S:
-                    self.toggleSortOrder()
+                        if key == Keys.R:
+                            self.refreshList()
 
-                if key == Keys.R:
-                    self.refreshList()
+                        if key == Keys.A:
+                            self.fetchAll()
 
-                if key == Keys.A:
-                    self.fetchAll()
+                        if key == Keys.M and branch:
+                            self.merge(screen, branch)
 
-                if key == Keys.M and branch:
-                    self.merge(screen, branch)
+                        if key == Keys.Q:
+                            self.stopLoop()
 
-                if key == Keys.Q:
-                    self.stopLoop()
+                        if key == Keys.D and branch:
+                            if not branch.remote:
+                                self.deleteBranchConfirmed(screen, branch)
 
-                if key == Keys.D and branch:
-                    if not branch.remote:
-                        self.deleteBranchConfirmed(screen, branch)
+                        if key == Keys.U:
+                            self.__showUpstreams = not self.__showUpstreams
 
-                if key == Keys.U:
-                    self.__showUpstreams = not self.__showUpstreams
+        self.cancelDiffJobs()
+        self.__diffPool.shutdown(wait=False)
+        self.cancelFetchJobs()
 
     def checkoutSelectedBranch(self, screen, branch):
-        if branch.reference == self.__repo.active_branch():
-            self.errorMessage = 'error: Branch \'{}\' is already your active branch.\n'.format(branch.reference)
+        if not branch.remote and branch.head == self.activeBranchName():
+            self.errorMessage = 'error: Branch \'{}\' is already your active branch.\n'.format(branch.head)
 
         elif branch.remote:
             text = 'Checking out a remote branch will result in a detached head. Continue?'
@@ -465,8 +639,8 @@ class UI(ListViewDelegate, ListViewDataSource):
 
     def checkoutBranch(self, branch):
         try:
-            branch.reference.checkout()
-        except GitCommandError as e:
+            self.__repo.checkoutBranch(branch)
+        except git.GitCommandError as e:
             self.errorMessage = e.stderr
 
         if self.__keepOpen:
@@ -502,7 +676,7 @@ class UI(ListViewDelegate, ListViewDataSource):
         self.setFilter('')
 
     def applyFilter(self):
-        self.__filteredBranches = list(filter(lambda item: self.__filter.lower() in item.head.lower(), self.__branches))
+        self.__matches = self.__filterIndex.search(self.__filter)
         self.sort()
 
     def toggleLocalOnly(self):
@@ -510,13 +684,25 @@ class UI(ListViewDelegate, ListViewDataSource):
         self.refreshList()
 
     def sort(self):
-        self.__filteredBranches = sorted(self.__filteredBranches, key=lambda branch: branch.head, reverse=self.__sortDescending)
+        matches = self.__matches[::-1] if self.__sortDescending else self.__matches
+        if self.__filter:
+            matches = sorted(matches, key=lambda match: -match[1])
+
+        self.__filteredBranches = [branch for branch, _ in matches]
 
     def toggleSortOrder(self):
         self.__sortDescending = not self.__sortDescending
         self.sort()
 
     def build_row(self, i, data, is_selected, width) -> View:
+        if data.pending and data.refname not in self.__scheduled:
+            self.prefetchDiffs(i)
+
+        isCheckedOut = data.head == self.__activeBranchName and not data.remote
+        key = (data, is_selected, isCheckedOut, data.pending, data.commitsAhead, data.commitsBehind, self.__showUpstreams, self.__maxRemoteNameLength)
+        return self.__rowCache.get(key, width, lambda: self.buildRowView(data, is_selected, isCheckedOut))
+
+    def buildRowView(self, data, is_selected, isCheckedOut):
         rowHBox = HBox()
 
         if data.remote:
@@ -528,7 +714,6 @@ class UI(ListViewDelegate, ListViewDataSource):
             remoteLabel.attributes.append(curses.color_pair(Colorpairs.REMOTE))
             remoteLabel.attributes.append(curses.A_BOLD)
 
-        isCheckedOut = data.head == self.__repo.active_branch_name() and not data.remote
         checkedOutPrefix = '*' if isCheckedOut else ' '
         headLabel = Label(checkedOutPrefix+data.head)
         rowHBox.add_view(headLabel, Padding(2, 0, 0, 0))
@@ -542,7 +727,7 @@ class UI(ListViewDelegate, ListViewDataSource):
                 upstreamLabel.attributes.append(curses.color_pair(Colorpairs.UPSTREAM))
                 rowHBox.add_view(upstreamLabel, Padding(1, 0, 0, 0))
 
-            diffLabel = Label(data.diff)
+            diffLabel = Label(DIFF_PLACEHOLDER if data.pending else data.diff)
             diffLabel.attributes.append(curses.color_pair(Colorpairs.DIFF))
             diffLabel.attributes.append(curses.A_BOLD)
             rowHBox.add_view(diffLabel, Padding(2, 0, 0, 0))
@@ -563,6 +748,37 @@ class UI(ListViewDelegate, ListViewDataSource):
         return self.__filteredBranches[i]
 
 
+def branchRecord(branch, commitTime):
+    return {
+        'name': branch.head,
+        'remote': branch.remote,
+        'upstream': branch.upstream,
+        'ahead': branch.commitsAhead,
+        'behind': branch.commitsBehind,
+        'sha': branch.sha,
+        'lastCommitTime': commitTime
+    }
+
+
+def printBranches(repo, ndjson):
+    behind = False
+
+    def records():
+        nonlocal behind
+        # remote branches have no upstream, only the local ones need ahead and behind counts
+        branches = repo.getBranches(local=True, remotes=True, withDiffs=False)
+        for start in range(0, len(branches), DIFF_CHUNK_SIZE):
+            chunk = branches[start:start + DIFF_CHUNK_SIZE]
+            repo.materialize(chunk)
+            for branch in chunk:
+                behind = behind or bool(branch.commitsBehind)
+                yield branchRecord(branch, repo.commitTime(branch.sha))
+
+    write_records(records(), ndjson)
+    repo.close()
+    return 1 if behind else 0
+
+
 def parseArguments():
     argparser = argparse.ArgumentParser(
         prog='branches',
@@ -578,17 +794,58 @@ def parseArguments():
         help="The app stays open after checking out a branch",
         action="store_true"
     )
+    argparser.add_argument(
+        '-j',
+        '--fetch-jobs',
+        help="The number of remotes that are fetched concurrently when fetching all remotes",
+        type=int,
+        default=FETCH_JOBS
+    )
+    argparser.add_argument(
+        '--trace',
+        help="Writes a Chrome trace of all git calls, renders and key presses to the given file",
+        metavar='FILE'
+    )
+    argparser.add_argument(
+        '--workspace',
+        help="Shows every git repository below ROOT, or the current directory, with its active branch and unpushed branches instead of a single repository",
+        nargs='?',
+        const='.',
+        metavar='ROOT'
+    )
+    output = argparser.add_mutually_exclusive_group()
+    output.add_argument(
+        '--json',
+        help="Writes the local and remote branches as a JSON array instead of starting the interactive list. Exits with 1 if a branch is behind its upstream",
+        action="store_true"
+    )
+    output.add_argument(
+        '--ndjson',
+        help="Writes the local and remote branches as one JSON object per line instead of starting the interactive list. Exits with 1 if a branch is behind its upstream",
+        action="store_true"
+    )
     return argparser.parse_args()
 
 
 if __name__ == '__main__':
     args = parseArguments()
+    if args.trace:
+        trace.enable(args.trace)
+
+    if args.workspace:
+        from workspace import print_workspace, run_workspace, SORT_UNPUSHED
+        if args.json or args.ndjson:
+            exit(print_workspace(args.workspace, args.ndjson, lambda summary: summary['outdated'] > 0))
+        exit(run_workspace(args.workspace, SORT_UNPUSHED))
 
     if args.PATH:
         repositoryDirectory = os.path.abspath(args.PATH)
     else:
         repositoryDirectory = os.getcwd()
-    repo = Repository(repositoryDirectory)
+    repo = Repository(repositoryDirectory, daemon=True)
+
+    if args.json or args.ndjson:
+        exit(printBranches(repo, args.ndjson))
 
     if repo.hasDetachedHead():
         shortPath = shortenPath(Path(repositoryDirectory))
@@ -596,8 +853,9 @@ if __name__ == '__main__':
         print(message, file=sys.stderr)
         exit(-1)
 
-    ui = UI(repo, args.keep_open)
+    ui = UI(repo, args.keep_open, max(1, args.fetch_jobs))
     curses.wrapper(ui.loop)
+    repo.close()
 
     if ui.errorMessage:
         print(ui.errorMessage, file=sys.stderr)
\ No newline at end of file
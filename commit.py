@@ -1,6 +1,7 @@
 import argparse
 import os
-from utils.git import Stage
+from utils.gitdir import find_repository, active_branch_name
+from utils import trace
 from subprocess import call
 
 def parseArguments():
@@ -26,6 +27,11 @@ def parseArguments():
         help="Verify hooks will be bypassed. This effects both commit and possible push hooks.",
         action="store_true"
     )
+    argparser.add_argument(
+        '--trace',
+        help="Writes a Chrome trace of the git calls to the given file.",
+        metavar='FILE'
+    )
     args = argparser.parse_args()
     return args
 
@@ -36,7 +42,9 @@ def commit(content='', noVerify=False):
     tmpFile.close()
 
     command = ['git', 'commit', '-t', tmpFilePath]
-    returnCode = call(command)
+    with trace.span('git commit', 'git', argv=command) as details:
+        returnCode = call(command)
+        details['exit_code'] = returnCode
 
     os.remove(tmpFilePath)
 
@@ -47,22 +55,25 @@ def push(noVerify=False):
     if noVerify:
         command.append('--no-verify')
 
-    returnCode = call(command)
+    with trace.span('git push', 'git', argv=command) as details:
+        returnCode = call(command)
+        details['exit_code'] = returnCode
 
     return returnCode == 0
 
 if __name__ == '__main__':
     args = parseArguments()
+    if args.trace:
+        trace.enable(args.trace)
 
     commitSuccessful = False
     if args.empty:
         commitSuccessful = commit(noVerify=args.no_verify)
 
     else:
-        repository_directory = os.getcwd()
-        stage = Stage(repository_directory)
+        repository = find_repository(os.getcwd())
 
-        name = stage.active_branch_name().split('/')[-1]
+        name = active_branch_name(repository.git_dir).split('/')[-1]
         ticket = '-'.join(name.split('-')[:2])
 
         if ticket in ['master', 'develop']:
@@ -0,0 +1,202 @@
+import argparse
+import os
+import selectors
+import socket
+import subprocess
+import sys
+import time
+from utils.daemon import socket_path, read_message, write_message, connect, DaemonError
+from utils.gitdir import refs_signature
+from utils.git import Stage
+
+IDLE_TIMEOUT = 900
+POLL_INTERVAL = 0.1
+MAX_PATCHED_PATHS = 256
+
+
+class Daemon:
+
+    def __init__(self, directory, idleTimeout):
+        self.__stage = Stage(directory)
+        self.__idleTimeout = idleTimeout
+        self.__path = socket_path(self.__stage.git_dir)
+        self.__refreshStatus()
+        self.__branches = {}
+        self.__running = True
+
+        try:
+            self.__watcher = self.__stage.watch()
+        except OSError:
+            self.__watcher = None
+
+        self.__discardOwnChanges()
+
+    def __refsSignature(self):
+        return refs_signature(self.__stage.git_dir, self.__stage.common_dir)
+
+    def __refreshStatus(self):
+        # commits, resets and checkouts change the status without touching any watched file
+        self.__filesSignature = self.__refsSignature()
+        self.__files = self.__stage.status()
+
+    def __discardOwnChanges(self):
+        if self.__watcher is not None:
+            self.__watcher.discard()
+
+    def applyChanges(self, changes):
+        paths, fullRefresh = changes
+        if fullRefresh or len(paths) > MAX_PATCHED_PATHS:
+            self.__refreshStatus()
+            self.__discardOwnChanges()
+        elif paths:
+            self.__stage.update_status(self.__files, paths)
+            if self.__watcher is not None:
+                self.__watcher.discard_paths(paths)
+
+    def status(self):
+        if self.__watcher is None or self.__refsSignature() != self.__filesSignature:
+            self.__refreshStatus()
+            self.__discardOwnChanges()
+        else:
+            changes = self.__watcher.flush()
+            if changes:
+                self.applyChanges(changes)
+
+        return [file.to_record() for file in self.__files]
+
+    def branches(self, local=True, remotes=False, withDiffs=True):
+        signature = self.__refsSignature()
+        key = (local, remotes, withDiffs)
+        cached = self.__branches.get(key)
+        if cached is None or cached[0] != signature:
+            branches = self.__stage.getBranches(local=local, remotes=remotes, withDiffs=withDiffs)
+            cached = (signature, [branch.to_record() for branch in branches])
+            self.__branches[key] = cached
+
+        return cached[1]
+
+    def ping(self):
+        return os.getpid()
+
+    def shutdown(self):
+        self.__running = False
+        return True
+
+    def handle(self, connection):
+        with connection:
+            try:
+                request = read_message(connection)
+                method = {
+                    'status': self.status,
+                    'branches': self.branches,
+                    'ping': self.ping,
+                    'shutdown': self.shutdown
+                }[request['method']]
+                response = {'result': method(**request.get('params', {}))}
+            except Exception as e:
+                response = {'error': '{}: {}'.format(type(e).__name__, e)}
+
+            try:
+                write_message(connection, response)
+            except OSError:
+                pass
+
+    def serve(self):
+        os.makedirs(os.path.dirname(self.__path), exist_ok=True)
+        if os.path.exists(self.__path):
+            os.remove(self.__path)
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.__path)
+        server.listen()
+
+        selector = selectors.DefaultSelector()
+        selector.register(server, selectors.EVENT_READ)
+        if self.__watcher is not None:
+            selector.register(self.__watcher, selectors.EVENT_READ)
+
+        lastRequest = time.monotonic()
+        try:
+            while self.__running and time.monotonic() - lastRequest < self.__idleTimeout:
+                for key, _ in selector.select(timeout=POLL_INTERVAL):
+                    if key.fileobj is server:
+                        connection, _ = server.accept()
+                        self.handle(connection)
+                        lastRequest = time.monotonic()
+
+                if self.__watcher is not None:
+                    changes = self.__watcher.poll()
+                    if changes:
+                        self.applyChanges(changes)
+        finally:
+            selector.close()
+            server.close()
+            if os.path.exists(self.__path):
+                os.remove(self.__path)
+            if self.__watcher is not None:
+                self.__watcher.close()
+            self.__stage.close()
+
+
+def runningDaemon(directory):
+    client = connect(Stage(directory).git_dir)
+    if client is None:
+        return None
+
+    try:
+        client.request('ping')
+        return client
+    except (OSError, ValueError, DaemonError):
+        return None
+
+
+def parseArguments():
+    argparser = argparse.ArgumentParser(
+        prog='daemon',
+        description='Keeps the status and branches of a repository warm for stage and branches.'
+    )
+    argparser.add_argument(
+        'PATH', nargs="?",
+        help='The path to the git repository that shall be used. If no path is provided the current working directory will be used.'
+    )
+    argparser.add_argument(
+        '-s',
+        '--stop',
+        help="Stops the daemon of the repository.",
+        action="store_true"
+    )
+    argparser.add_argument(
+        '-f',
+        '--foreground',
+        help="The daemon is not detached from the terminal.",
+        action="store_true"
+    )
+    argparser.add_argument(
+        '-t',
+        '--idle-timeout',
+        help="The number of seconds without requests after which the daemon shuts itself down. Defaults to {}.".format(IDLE_TIMEOUT),
+        type=int,
+        default=IDLE_TIMEOUT
+    )
+    return argparser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parseArguments()
+    repositoryDirectory = os.path.abspath(args.PATH) if args.PATH else os.getcwd()
+    client = runningDaemon(repositoryDirectory)
+
+    if args.stop:
+        if client:
+            client.request('shutdown')
+        exit(0)
+
+    if client:
+        print('A daemon is already running for this repository.', file=sys.stderr)
+        exit(0)
+
+    if args.foreground:
+        Daemon(repositoryDirectory, args.idle_timeout).serve()
+    else:
+        command = [sys.executable, os.path.abspath(__file__), '--foreground', '--idle-timeout', str(args.idle_timeout), repositoryDirectory]
+        subprocess.Popen(command, start_new_session=True, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
@@ -13,6 +13,9 @@ COMMIT_FUNCTION_NAME="commit"
 BRANCHES_RUN_SCRIPT="branches.sh"
 BRANCHES_FUNCTION_NAME="branches"
 
+DAEMON_RUN_SCRIPT="daemon.sh"
+DAEMON_FUNCTION_NAME="git-toolbox-daemon"
+
 BASEDIR=$(cd "$(dirname "$0")/"; pwd)
 
 if [ -x "$(command -v conda)" ]; then
@@ -34,6 +37,7 @@ fi
 echo "function $STAGE_FUNCTION_NAME { $BASEDIR/$STAGE_RUN_SCRIPT \$@; }" >> ~/.bash_profile
 echo "function $COMMIT_FUNCTION_NAME { $BASEDIR/$COMMIT_RUN_SCRIPT \$@; }" >> ~/.bash_profile
 echo "function $BRANCHES_FUNCTION_NAME { $BASEDIR/$BRANCHES_RUN_SCRIPT \$@; }" >> ~/.bash_profile
+echo "function $DAEMON_FUNCTION_NAME { $BASEDIR/$DAEMON_RUN_SCRIPT \$@; }" >> ~/.bash_profile
 
 
 clear
@@ -1,11 +1,19 @@
+import argparse
 import curses
 import os
+import queue
+import threading
+from concurrent.futures import Future
 from pathlib import Path
 
 from gupy.geometry import Padding
 from gupy.screen import ConstrainedBasedScreen
 from gupy.view import ListView, Label, HBox, BackgroundView
 from utils.git import Stage
+from utils.input import pending_keys
+from utils.output import write_records
+from utils.rowcache import RowCache
+from utils import trace
 
 KEY_SPACE=ord(' ')
 KEY_ENTER=ord('\n')
@@ -16,6 +24,15 @@ KEY_A=ord('a')
 KEY_I=ord('i')
 KEY_S=ord('s')
 KEY_P=ord('p')
+KEY_X=ord('x')
+KEY_V=ord('v')
+KEY_T=ord('t')
+KEY_D=ord('d')
+KEY_U=ord('u')
+
+WATCH_INTERVAL=100
+SCAN_INTERVAL=50
+MAX_PATCHED_PATHS=256
 
 COLOR_PAIR_DEFAULT=0
 COLOR_PAIR_TITLE=1
@@ -31,9 +48,16 @@ COLOR_PAIR_UNTRACKED=10
 COLOR_PAIR_STAGED=11
 COLOR_PAIR_CONFIRMATION=12
 COLOR_PAIR_CONFIRMATION_SELECTION=13
+COLOR_PAIR_SCANNING=14
 
 LEGEND=[
-    ('[SPACE]', ' Toggle file '),
+    ('[SPACE]', ' Toggle file/marked '),
+    ('[X]', ' Mark '),
+    ('[V]', ' Mark range '),
+    ('[T]', ' Mark type '),
+    ('[D]', ' Mark directory '),
+    ('[U]', ' Unmark all '),
+    ('[ENTER]', ' Expand/collapse '),
     ('[A]', ' Toggle all '),
     ('[I]', ' Ignore file '),
     ('[S]', ' Stash all '),
@@ -44,11 +68,100 @@ LEGEND=[
 ]
 
 
+def mark_key(file):
+    return file.get_sort_key()
+
+
 class TableViewDelegate:
 
-    def __init__(self, change_type_colors, files=[]):
+    def __init__(self, change_type_colors, files=[], count_files=None):
         self.change_type_colors = change_type_colors
         self.files = files
+        self.marked = set()
+        self.mark_anchor = None
+        self.row_cache = RowCache()
+        self.count_files = count_files
+        self.directory_sizes = {}
+        self.size_jobs = {}
+        self.size_queue = None
+
+    def directory_size(self, directory):
+        if directory in self.directory_sizes or self.count_files is None:
+            return self.directory_sizes.get(directory)
+
+        if directory not in self.size_jobs:
+            if self.size_queue is None:
+                # a daemon thread, so quitting never waits for the walk of a huge untracked tree
+                self.size_queue = queue.Queue()
+                threading.Thread(target=self.count_sizes, daemon=True).start()
+            job = Future()
+            self.size_jobs[directory] = job
+            self.size_queue.put((directory, job))
+
+        return None
+
+    def count_sizes(self):
+        while True:
+            directory, job = self.size_queue.get()
+            if not job.set_running_or_notify_cancel():
+                continue
+
+            try:
+                job.set_result(self.count_files(directory))
+            except Exception as e:
+                job.set_exception(e)
+
+    def collect_sizes(self):
+        collected = False
+        for directory, job in list(self.size_jobs.items()):
+            if job.done():
+                del self.size_jobs[directory]
+                self.directory_sizes[directory] = None if job.exception() else job.result()
+                collected = True
+
+        return collected
+
+    def forget_sizes(self, paths=None):
+        for job in self.size_jobs.values():
+            job.cancel()
+        self.size_jobs.clear()
+
+        if paths is None:
+            self.directory_sizes.clear()
+            return
+
+        for directory in list(self.directory_sizes):
+            if any(path.startswith(directory) or directory.startswith(path) for path in paths):
+                del self.directory_sizes[directory]
+
+    def is_marked(self, file):
+        return mark_key(file) in self.marked
+
+    def toggle_mark(self, i):
+        key = mark_key(self.files[i])
+        if key in self.marked:
+            self.marked.remove(key)
+        else:
+            self.marked.add(key)
+        self.mark_anchor = i
+
+    def mark_range(self, i):
+        anchor = i if self.mark_anchor is None else min(self.mark_anchor, len(self.files) - 1)
+        for file in self.files[min(anchor, i):max(anchor, i)+1]:
+            self.marked.add(mark_key(file))
+        self.mark_anchor = i
+
+    def mark_where(self, predicate):
+        for file in self.files:
+            if predicate(file):
+                self.marked.add(mark_key(file))
+
+    def clear_marks(self):
+        self.marked.clear()
+        self.mark_anchor = None
+
+    def marked_files(self):
+        return [file for file in self.files if mark_key(file) in self.marked]
 
     def number_of_rows(self):
         return len(self.files)
@@ -57,13 +170,21 @@ class TableViewDelegate:
         return self.files[i]
 
     def build_row(self, i, file, is_selected, width):
+        key = (file, is_selected, self.is_marked(file), file.is_directory() and self.directory_size(file.get_relative_path()))
+        return self.row_cache.get(key, width, lambda: self.make_row(file, is_selected, width))
+
+    def make_row(self, file, is_selected, width):
         hbox = HBox()
 
+        mark_label = Label('*' if self.is_marked(file) else ' ')
+        mark_label.attributes.append(curses.A_BOLD)
+        hbox.add_view(mark_label, Padding(1, 0, 0, 0))
+
         staged_char = '+'
         if file.is_staged() is not True:
             staged_char = ' '
         staged_label = Label(staged_char)
-        hbox.add_view(staged_label, Padding(2, 0, 0, 0))
+        hbox.add_view(staged_label, Padding(0, 0, 0, 0))
 
         change_type = file.get_change_type()
         change_type_label = Label(change_type)
@@ -72,6 +193,9 @@ class TableViewDelegate:
         hbox.add_view(change_type_label, Padding(3, 0, 2, 0))
 
         path_to_show = file.get_relative_path()
+        if file.is_directory():
+            size = self.directory_sizes.get(path_to_show)
+            path_to_show += ' ({} files)'.format('…' if size is None else size)
         available_width = width - hbox.required_size().width
         if available_width < len(path_to_show):
             path_to_show = '...' + path_to_show[len(path_to_show)-available_width+4:]
@@ -93,9 +217,10 @@ class TableViewDelegate:
         return result
 
 
-def main(stdscr):
+def main(stdscr, watch=False):
     repository_directory = os. getcwd()
-    stage = Stage(repository_directory)
+    stage = Stage(repository_directory, daemon=True)
+    watcher = stage.watch() if watch else None
 
     curses.curs_set(0)
     curses.init_pair(COLOR_PAIR_TITLE, curses.COLOR_BLACK, curses.COLOR_WHITE)
@@ -113,6 +238,7 @@ def main(stdscr):
     curses.init_pair(COLOR_PAIR_STAGED, curses.COLOR_GREEN, curses.COLOR_BLACK)
     curses.init_pair(COLOR_PAIR_CONFIRMATION, curses.COLOR_WHITE, curses.COLOR_RED)
     curses.init_pair(COLOR_PAIR_CONFIRMATION_SELECTION, curses.COLOR_BLACK, curses.COLOR_WHITE)
+    curses.init_pair(COLOR_PAIR_SCANNING, curses.COLOR_BLUE, curses.COLOR_WHITE)
 
     change_type_colors = {
         'A': curses.color_pair(COLOR_PAIR_ADDED),
@@ -144,9 +270,19 @@ def main(stdscr):
     branch_label.attributes.append(curses.color_pair(COLOR_PAIR_BRANCH))
     branch_label.attributes.append(curses.A_BOLD)
 
+    scanning_label = Label()
+    scanning_label.attributes.append(curses.color_pair(COLOR_PAIR_SCANNING))
+
     title_hbox = HBox()
     title_hbox.add_view(repo_label, Padding(0, 0, 0, 0))
     title_hbox.add_view(branch_label, Padding(1, 0, 0, 0))
+    title_hbox.add_view(scanning_label, Padding(1, 0, 0, 0))
+
+    accelerations = stage.accelerations()
+    if accelerations:
+        accelerations_label = Label('[{}]'.format(', '.join(accelerations)))
+        accelerations_label.attributes.append(curses.color_pair(COLOR_PAIR_TITLE))
+        title_hbox.add_view(accelerations_label, Padding(1, 0, 0, 0))
     screen.add_view(title_hbox, lambda w, h, v: ((w-v.required_size().width)//2, 0, title_hbox.required_size().width+1, 1))
 
     more_label = Label('')
@@ -170,9 +306,74 @@ def main(stdscr):
     screen.add_view(legend_hbox, lambda w, h, v: (0, h-1, w-more_label.required_size().width, 1))
     screen.add_view(more_label, lambda  w, h, v: (w-v.required_size().width-1, h-1, v.required_size().width, 1))
 
-    delegate = TableViewDelegate(change_type_colors)
+    delegate = TableViewDelegate(change_type_colors, count_files=stage.count_untracked)
+    def discard_own_changes():
+        if watcher is not None:
+            watcher.discard()
+
+    def discard_own_index_changes():
+        # status rewrites the index while it scans, files edited meanwhile are picked up by the next poll
+        if watcher is not None:
+            watcher.discard_index_changes()
+
+    scan = None
+
     def refresh_stage():
-        delegate.files = stage.status()
+        nonlocal scan
+        if scan is not None:
+            scan.cancel()
+
+        discard_own_changes()
+        scan = stage.scan()
+        delegate.files = []
+        delegate.row_cache.clear()
+        delegate.forget_sizes()
+        poll_scan()
+
+    def poll_scan():
+        nonlocal scan
+        files = scan.poll()
+        if files is not None:
+            delegate.files = files
+
+        if scan.is_running():
+            scanning_label.text = '[scanning {} files]'.format(len(delegate.files))
+        else:
+            scan = None
+            scanning_label.text = ''
+            discard_own_index_changes()
+
+        return files is not None or scan is None
+
+    def refresh_paths(paths):
+        for patch in stage.update_status(delegate.files, paths):
+            if scan is not None:
+                scan.overlay(*patch)
+        delegate.forget_sizes(paths)
+        if watcher is not None:
+            watcher.discard_paths(paths)
+
+    def refresh_files(files):
+        paths = sorted({file.get_relative_path() for file in files})
+        if any(file.is_renamed() for file in files) or len(paths) > MAX_PATCHED_PATHS:
+            refresh_stage()
+        else:
+            refresh_paths(paths)
+
+    def toggle_files(files):
+        unstaged = [file for file in files if not file.is_staged()]
+        if unstaged:
+            stage.add_files(unstaged)
+        else:
+            stage.reset_files(files)
+        refresh_files(files)
+
+    def apply_changes(changes):
+        paths, full_refresh = changes
+        if full_refresh or len(paths) > MAX_PATCHED_PATHS:
+            refresh_stage()
+        elif paths:
+            refresh_paths(paths)
 
     refresh_stage()
 
@@ -184,7 +385,11 @@ def main(stdscr):
 
     def perform_checkout(file):
         stage.checkout(file)
-        refresh_stage()
+        refresh_files([file])
+
+    def perform_clean(file):
+        stage.clean(file)
+        refresh_files([file])
 
     confirmation_background = BackgroundView(curses.color_pair(COLOR_PAIR_CONFIRMATION))
     confirmation_text_label = Label()
@@ -219,83 +424,239 @@ def main(stdscr):
         screen.remove_view(confirmation_text_label)
 
 
+    dirty = True
     while 1:
-        branch_label.text = '['+stage.active_branch_name()+']'
-
-        screen.render()
+        branch_text = '['+stage.active_branch_name()+']'
+        if branch_label.text != branch_text:
+            branch_label.text = branch_text
+            dirty = True
+
+        if dirty:
+            with trace.span('render', 'ui'):
+                screen.render()
+            dirty = False
+
+        if scan is not None or delegate.size_jobs:
+            stdscr.timeout(SCAN_INTERVAL)
+        elif watcher is not None:
+            stdscr.timeout(WATCH_INTERVAL)
+        else:
+            stdscr.timeout(-1)
         key = stdscr.getch()
 
-        if key == KEY_Q:
-            exit(0)
-
-        if confirmation_active:
-            if key == curses.KEY_LEFT:
-                yes_selected = False
-                update_confirmation_answer_labels()
+        if delegate.collect_sizes():
+            dirty = True
+        if scan is not None:
+            if poll_scan():
+                dirty = True
+        elif watcher is not None:
+            changes = watcher.poll()
+            if changes:
+                apply_changes(changes)
+                dirty = True
+
+        # all keys that arrived while rendering are handled before the next render
+        for key in pending_keys(stdscr, key):
+            dirty = True
+            with trace.span('input', 'ui', key=key):
+
+                if key == KEY_Q:
+                    if scan is not None:
+                        scan.cancel()
+                    stage.close()
+                    exit(0)
+
+                if confirmation_active:
+                    if key == curses.KEY_LEFT:
+                        yes_selected = False
+                        update_confirmation_answer_labels()
+
+                    elif key == curses.KEY_RIGHT:
+                        yes_selected = True
+                        update_confirmation_answer_labels()
+
+                    elif key == KEY_ENTER:
+                        confirmation_active = False
+                        hide_confirmation()
+                        if yes_selected and confirmation_action is not None:
+                            confirmation_action()
 
-            elif key == curses.KEY_RIGHT:
-                yes_selected = True
-                update_confirmation_answer_labels()
-
-            elif key == KEY_ENTER:
-                confirmation_active = False
-                hide_confirmation()
-                if yes_selected and confirmation_action is not None:
-                    confirmation_action()
-
-        else:
-            if key == curses.KEY_UP:
-                list_view.select_previous()
+                else:
+                    if key == curses.KEY_UP:
+                        list_view.select_previous()
+
+                    elif key == curses.KEY_DOWN:
+                        list_view.select_next()
+
+                    elif key == KEY_SPACE:
+                        if delegate.marked:
+                            toggle_files(delegate.marked_files())
+                            delegate.clear_marks()
+                        elif delegate.number_of_rows() > 0:
+                            file = delegate.get_data(list_view.get_selected_row_index())
+                            toggle_files([file])
+                            list_view.select_next()
+
+                    elif key == KEY_X and delegate.number_of_rows() > 0:
+                        delegate.toggle_mark(list_view.get_selected_row_index())
+                        list_view.select_next()
+
+                    elif key == KEY_V and delegate.number_of_rows() > 0:
+                        delegate.mark_range(list_view.get_selected_row_index())
+
+                    elif key == KEY_T and delegate.number_of_rows() > 0:
+                        change_type = delegate.get_data(list_view.get_selected_row_index()).get_change_type()
+                        delegate.mark_where(lambda file: file.get_change_type() == change_type)
+
+                    elif key == KEY_D and delegate.number_of_rows() > 0:
+                        directory = os.path.dirname(delegate.get_data(list_view.get_selected_row_index()).get_relative_path())
+                        prefix = directory + '/' if directory else ''
+                        delegate.mark_where(lambda file: file.get_relative_path().startswith(prefix))
+
+                    elif key == KEY_U:
+                        delegate.clear_marks()
+
+                    elif key == KEY_ENTER and delegate.number_of_rows() > 0:
+                        file = delegate.get_data(list_view.get_selected_row_index())
+                        path = file.get_relative_path()
+                        if file.is_directory():
+                            stage.expand(path)
+                            refresh_paths([path])
+                        else:
+                            directory = stage.expanded_directory(path)
+                            if directory is not None:
+                                stage.collapse(directory)
+                                refresh_paths([directory])
+
+                    elif key == KEY_A:
+                        all_staged = True
+                        for file in stage.status() if scan is not None else delegate.files:
+                            if file.is_staged() is not True:
+                                all_staged = False
+                                break
+
+                        if all_staged:
+                            stage.reset_all()
+                        else:
+                            stage.add_all()
+                        refresh_stage()
+
+                    elif key == KEY_I and delegate.number_of_rows() > 0:
+                        file = delegate.get_data(list_view.get_selected_row_index())
+                        if file.is_tracked() is not True:
+                            stage.ignore(file)
+                            refresh_stage()
+
+                    elif key == KEY_S:
+                        if len(stage.status() if scan is not None else delegate.files) > 0:
+                            stage.stash_all()
+                            refresh_stage()
+
+                    elif key == KEY_P:
+                        stage.pop_stash()
+                        refresh_stage()
+
+                    elif key == KEY_C and delegate.number_of_rows() > 0:
+                        file = delegate.get_data(list_view.get_selected_row_index())
+                        if file.is_tracked():
+                            confirmation_active = True
+                            yes_selected = False
+                            confirmation_action = lambda : perform_checkout(file)
+                            show_confirmation('Checkout selected file?')
+                        elif file.is_directory():
+                            confirmation_active = True
+                            yes_selected = False
+                            confirmation_action = lambda : perform_clean(file)
+                            show_confirmation('Delete untracked directory?')
+
+                    elif key == KEY_R:
+                        refresh_stage()
+
+def file_record(file):
+    return {
+        'path': file.get_relative_path(),
+        'change_type': file.get_change_type(),
+        'tracked': file.is_tracked(),
+        'staged': file.is_staged(),
+        'renamed': file.is_renamed(),
+        'directory': file.is_directory()
+    }
 
-            elif key == curses.KEY_DOWN:
-                list_view.select_next()
 
-            elif key == KEY_SPACE:
-                file = delegate.get_data(list_view.get_selected_row_index())
-                if file.is_staged():
-                    stage.reset(file)
-                else:
-                    stage.add(file)
-                refresh_stage()
-                list_view.select_next()
-
-            elif key == KEY_A:
-                all_staged = True
-                for file in stage.status():
-                    if file.is_staged() is not True:
-                        all_staged = False
-                        break
-
-                if all_staged:
-                    stage.reset_all()
-                else:
-                    stage.add_all()
-                refresh_stage()
-
-            elif key == KEY_I:
-                file = delegate.get_data(list_view.get_selected_row_index())
-                if file.is_tracked() is not True:
-                    stage.ignore(file)
-                    refresh_stage()
-
-            elif key == KEY_S:
-                if len(stage.status()) > 0:
-                    stage.stash_all()
-                    refresh_stage()
-
-            elif key == KEY_P:
-                stage.pop_stash()
-                refresh_stage()
-
-            elif key == KEY_C:
-                file = delegate.get_data(list_view.get_selected_row_index())
-                if file.is_tracked():
-                    confirmation_active = True
-                    yes_selected = False
-                    confirmation_action = lambda : perform_checkout(file)
-                    show_confirmation('Checkout selected file?')
-
-            elif key == KEY_R:
-                refresh_stage()
-
-curses.wrapper(main)
+def print_status(stage, ndjson):
+    dirty = False
+
+    def records():
+        nonlocal dirty
+        for file in stage.stream_status():
+            dirty = True
+            yield file_record(file)
+
+    write_records(records(), ndjson)
+    stage.close()
+    return 1 if dirty else 0
+
+
+def parse_arguments():
+    argparser = argparse.ArgumentParser(
+        prog='stage',
+        description='Gives you an interactive overview of your staged, unstaged and untracked files'
+    )
+    argparser.add_argument(
+        '-w',
+        '--watch',
+        help="The list is updated automatically when files in the working tree or the index change.",
+        action="store_true"
+    )
+    argparser.add_argument(
+        '--trace',
+        help="Writes a Chrome trace of all git calls, renders and key presses to the given file.",
+        metavar='FILE'
+    )
+    argparser.add_argument(
+        '--enable-accelerations',
+        help="Turns on git's untracked cache, split index and, where supported, the built-in fsmonitor for the repository and exits.",
+        action="store_true"
+    )
+    argparser.add_argument(
+        '--workspace',
+        help="Shows every git repository below ROOT, or the current directory, with its changes and ahead/behind counts instead of a single repository.",
+        nargs='?',
+        const='.',
+        metavar='ROOT'
+    )
+    output = argparser.add_mutually_exclusive_group()
+    output.add_argument(
+        '--json',
+        help="Writes the status as a JSON array instead of starting the interactive list. Exits with 1 if the working tree is dirty.",
+        action="store_true"
+    )
+    output.add_argument(
+        '--ndjson',
+        help="Writes the status as one JSON object per line instead of starting the interactive list. Exits with 1 if the working tree is dirty.",
+        action="store_true"
+    )
+    return argparser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    if args.trace:
+        trace.enable(args.trace)
+
+    if args.enable_accelerations:
+        accelerations = Stage(os.getcwd()).enable_accelerations()
+        print('Active accelerations: {}'.format(', '.join(accelerations) if accelerations else 'none'))
+        exit(0)
+
+    if args.workspace:
+        from utils.workspace import is_dirty
+        from workspace import print_workspace, run_workspace, SORT_CHANGES
+        if args.json or args.ndjson:
+            exit(print_workspace(args.workspace, args.ndjson, is_dirty))
+        exit(run_workspace(args.workspace, SORT_CHANGES))
+
+    if args.json or args.ndjson:
+        exit(print_status(Stage(os.getcwd(), daemon=True), args.ndjson))
+
+    curses.wrapper(main, args.watch)
@@ -2,9 +2,10 @@
 
 ENV_NAME="git-toolbox-env"
 
-if [ ! -z "$1" ]
+if [ ! -z "$1" ] && [[ "$1" != -* ]]
   then
     cd $1
+    shift
 fi
 
 if [ -x "$(command -v conda)" ]; then
@@ -12,4 +13,4 @@ if [ -x "$(command -v conda)" ]; then
 fi
 
 BASEDIR=$(dirname "$0")
-python "$BASEDIR/stage.py"
\ No newline at end of file
+python "$BASEDIR/stage.py" $@
\ No newline at end of file
@@ -0,0 +1,68 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+
+CAPACITY = 20000
+
+
+class AheadBehindCache:
+
+    def __init__(self, path, capacity=CAPACITY):
+        super().__init__()
+        self.__path = path
+        self.__capacity = capacity
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+        self.__dirty = False
+        self.__load()
+
+    def __load(self):
+        try:
+            with open(self.__path) as file:
+                entries = json.load(file)
+        except (OSError, ValueError):
+            return
+
+        if isinstance(entries, dict):
+            for key, value in entries.items():
+                if isinstance(value, list) and len(value) == 2:
+                    self.__entries[key] = tuple(value)
+
+        self.__evict()
+
+    def __evict(self):
+        while len(self.__entries) > self.__capacity:
+            self.__entries.popitem(last=False)
+
+    def get(self, head, upstream):
+        key = head + '...' + upstream
+        with self.__lock:
+            value = self.__entries.get(key)
+            if value is not None:
+                self.__entries.move_to_end(key)
+
+            return value
+
+    def put(self, head, upstream, commitsAhead, commitsBehind):
+        key = head + '...' + upstream
+        with self.__lock:
+            self.__entries[key] = (commitsAhead, commitsBehind)
+            self.__entries.move_to_end(key)
+            self.__evict()
+            self.__dirty = True
+
+    def save(self):
+        with self.__lock:
+            if not self.__dirty:
+                return
+
+            temporaryPath = '{}.{}.tmp'.format(self.__path, os.getpid())
+            try:
+                os.makedirs(os.path.dirname(self.__path), exist_ok=True)
+                with open(temporaryPath, 'w') as file:
+                    json.dump(self.__entries, file)
+                os.replace(temporaryPath, self.__path)
+                self.__dirty = False
+            except OSError:
+                pass
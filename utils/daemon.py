@@ -0,0 +1,67 @@
+import hashlib
+import json
+import os
+import socket
+import tempfile
+
+SOCKET_NAME = os.path.join('git-toolbox', 'daemon.sock')
+MAX_SOCKET_PATH = 100
+TIMEOUT = 10
+
+
+class DaemonError(Exception):
+    pass
+
+
+def socket_path(git_dir):
+    path = os.path.join(git_dir, SOCKET_NAME)
+    if len(os.fsencode(path)) <= MAX_SOCKET_PATH:
+        return path
+
+    digest = hashlib.sha1(os.fsencode(os.path.abspath(git_dir))).hexdigest()
+    return os.path.join(tempfile.gettempdir(), 'git-toolbox-{}.sock'.format(digest))
+
+
+def read_message(connection):
+    chunks = []
+    while True:
+        chunk = connection.recv(65536)
+        if not chunk:
+            break
+
+        chunks.append(chunk)
+        if chunk.endswith(b'\n'):
+            break
+
+    return json.loads(b''.join(chunks).decode()) if chunks else None
+
+
+def write_message(connection, message):
+    connection.sendall(json.dumps(message).encode() + b'\n')
+
+
+class DaemonClient:
+
+    def __init__(self, path):
+        super().__init__()
+        self.__path = path
+
+    def request(self, method, **params):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.settimeout(TIMEOUT)
+            connection.connect(self.__path)
+            write_message(connection, {'method': method, 'params': params})
+            response = read_message(connection)
+
+        if response is None:
+            raise DaemonError('The daemon closed the connection without a response')
+
+        if 'error' in response:
+            raise DaemonError(response['error'])
+
+        return response['result']
+
+
+def connect(git_dir):
+    path = socket_path(git_dir)
+    return DaemonClient(path) if os.path.exists(path) else None
@@ -0,0 +1,55 @@
+SUBSTRING_SCORE = 1000
+CONSECUTIVE_BONUS = 2
+BOUNDARY_BONUS = 1
+MAX_GAP_PENALTY = 3
+BOUNDARIES = '/-_. '
+
+
+def fuzzy_score(query, name):
+    position = name.find(query)
+    if position >= 0:
+        return SUBSTRING_SCORE - position
+
+    score = 0
+    last = -1
+    for character in query:
+        index = name.find(character, last + 1)
+        if index < 0:
+            return None
+
+        if index == last + 1:
+            score += CONSECUTIVE_BONUS
+        elif index == 0 or name[index - 1] in BOUNDARIES:
+            score += BOUNDARY_BONUS
+        else:
+            score -= min(index - last - 1, MAX_GAP_PENALTY)
+
+        last = index
+
+    return score
+
+
+class FuzzyIndex:
+
+    def __init__(self, items, key):
+        super().__init__()
+        self.__items = items
+        self.__names = [key(item).lower() for item in items]
+        self.__stack = [('', [(index, 0) for index in range(len(items))])]
+
+    def search(self, query):
+        query = query.lower()
+        while len(self.__stack) > 1 and not query.startswith(self.__stack[-1][0]):
+            self.__stack.pop()
+
+        previousQuery, previousMatches = self.__stack[-1]
+        if previousQuery != query:
+            matches = []
+            for index, _ in previousMatches:
+                score = fuzzy_score(query, self.__names[index])
+                if score is not None:
+                    matches.append((index, score))
+
+            self.__stack.append((query, matches))
+
+        return [(self.__items[index], score) for index, score in self.__stack[-1][1]]
@@ -1,22 +1,130 @@
+import heapq
+import os
+import re
 import subprocess
+import sys
+import threading
 
-from git import Repo, RemoteReference, Head
+from utils.cache import AheadBehindCache
+from utils.daemon import connect, DaemonError
+from utils.gitdir import find_repository, branch_name, index_has_extension, HeadCache, HEADS_PREFIX
+from utils.lazy import lazy_import
+from utils import trace
+from utils.process import GitProcesses
+from utils.refs import read_refs, parse_upstreams, short_refname, REMOTES_PREFIX, UPSTREAM_CONFIG
+from utils.watch import Watcher
+
+STATUS_COMMAND = ['status', '--porcelain=v2', '-z', '--untracked-files=normal']
+ALL_UNTRACKED_STATUS_COMMAND = ['status', '--porcelain=v2', '-z', '--untracked-files=all']
+TRACKED_STATUS_COMMAND = ['status', '--porcelain=v2', '-z', '--untracked-files=no']
+UNTRACKED_FILES_COMMAND = ['ls-files', '-z', '--others', '--exclude-standard']
+UNTRACKED_DIRECTORIES_COMMAND = UNTRACKED_FILES_COMMAND + ['--directory', '--no-empty-directory']
+FIRST_SCREEN_ROWS = 200
+ACCELERATION_CONFIG = r'^(core\.(untrackedcache|fsmonitor|splitindex)|feature\.manyfiles)$'
+# git config --get-regexp exits with 1 when no key matches
+CONFIG_EXIT_CODES = (0, 1)
+TRUE_VALUES = ('true', 'yes', 'on', '1')
+FALSE_VALUES = ('false', 'no', 'off', '0')
+UNTRACKED_CACHE = 'untracked cache'
+UNTRACKED_CACHE_EXTENSION = b'UNTR'
+FSMONITOR = 'fsmonitor'
+SPLIT_INDEX = 'split index'
+BRANCH_FORMAT = '%(refname)%00%(objectname)%00%(upstream)'
+TRACK_FORMAT = '%(refname)%00%(objectname)%00%(upstream)%00%(upstream:track,nobracket)'
+FETCH_JOBS = 4
+FAILED_FETCH = re.compile(r"could not fetch '?([^'\s]+)'?", re.IGNORECASE)
+AHEAD_BEHIND_CACHE = os.path.join('git-toolbox', 'ahead-behind.json')
+
+git = lazy_import('git')
+
+
+def _nul_records(stream, chunk_size=65536):
+    pending = b''
+    while True:
+        chunk = stream.read1(chunk_size)
+        if not chunk:
+            break
+
+        records = (pending + chunk).split(b'\0')
+        pending = records.pop()
+        for record in records:
+            yield os.fsdecode(record)
+
+    if pending:
+        yield os.fsdecode(pending)
+
+
+def _command_name(args):
+    for arg in args:
+        if not arg.startswith('-'):
+            return 'git ' + arg
+
+    return 'git'
+
+
+def patch_status(files, paths, updates):
+    exact = set(paths)
+    prefixes = tuple(path.rstrip('/') + '/' for path in paths)
+
+    def unaffected(file):
+        path = file.get_relative_path()
+        return path not in exact and not path.startswith(prefixes)
+
+    files[:] = heapq.merge(filter(unaffected, files), updates, key=File.get_sort_key)
+
+
+def directory_rows(files):
+    return {file.get_relative_path() for file in files if file.is_directory()}
+
+
+def collapsed_paths(files, paths):
+    directories = directory_rows(files)
+    result = set()
+    for path in paths:
+        parts = path.split('/')
+        for i in range(1, len(parts)):
+            directory = '/'.join(parts[:i]) + '/'
+            if directory in directories:
+                path = directory
+                break
+
+        result.add(path)
+
+    return sorted(result)
 
 
 class File:
 
+    __slots__ = ('__relative_path', '__tracked', '__staged', '__renamed', '__change_type', '__sort_key')
+
     def untracked_file(relative_path):
         return File(relative_path, False, False, False, '?')
 
-    def from_diff(diff, staged):
-        change_type = diff.change_type
-        if staged:
-            if 'A' == change_type:
-                change_type = 'D'
-            elif 'D' == change_type:
-                change_type = 'A'
-
-        return File(diff.a_path, True, staged, diff.renamed_file, change_type)
+    def from_porcelain(records):
+        for record in records:
+            kind = record[:1]
+            if kind == '1':
+                fields = record.split(' ', 8)
+                renamed = False
+            elif kind == '2':
+                fields = record.split(' ', 9)
+                next(records)
+                renamed = True
+            elif kind == 'u':
+                yield File(record.split(' ', 10)[10], True, False, False, 'M')
+                continue
+            elif kind == '?':
+                yield File.untracked_file(record[2:])
+                continue
+            else:
+                continue
+
+            path = fields[-1]
+            staged_type, unstaged_type = fields[1]
+            if staged_type != '.':
+                yield File(path, True, True, renamed, staged_type)
+            if unstaged_type != '.':
+                yield File(path, True, False, False, unstaged_type)
 
     def __init__(self, relative_path, tracked, staged, renamed, change_type):
         super().__init__()
@@ -24,7 +132,9 @@ class File:
         self.__tracked = tracked
         self.__staged = staged
         self.__renamed = renamed
-        self.__change_type = change_type
+        self.__change_type = sys.intern(change_type)
+        # the staged entry of a path is listed before its unstaged one
+        self.__sort_key = (relative_path, not staged)
 
     def get_relative_path(self):
         return self.__relative_path
@@ -41,13 +151,104 @@ class File:
     def get_change_type(self):
         return self.__change_type
 
+    def is_directory(self):
+        return self.__relative_path.endswith('/')
+
+    def get_sort_key(self):
+        return self.__sort_key
+
+    def to_record(self):
+        return [self.__relative_path, self.__tracked, self.__staged, self.__renamed, self.__change_type]
+
+    def from_record(record):
+        return File(*record)
+
 
 class Repository:
 
-    def __init__(self, directory):
+    def __init__(self, directory, daemon=False):
         super().__init__()
-        self.repo = Repo(directory)
         self.__directory = directory
+        self.__paths = find_repository(directory)
+        self.__repo = None
+        self.__aheadBehindCache = None
+        self.__daemon = connect(self.__paths.git_dir) if daemon else None
+        self.processes = GitProcesses(self.__paths.working_tree_dir)
+        self.__head = HeadCache(self.__paths.git_dir, self.__paths.common_dir)
+
+    @property
+    def repo(self):
+        if self.__repo is None:
+            with trace.span('Repo', 'gitpython', path=self.__paths.working_tree_dir):
+                self.__repo = git.Repo(self.__paths.working_tree_dir)
+
+        return self.__repo
+
+    @property
+    def working_tree_dir(self):
+        return self.__paths.working_tree_dir
+
+    @property
+    def git_dir(self):
+        return self.__paths.git_dir
+
+    @property
+    def common_dir(self):
+        return self.__paths.common_dir
+
+    def _daemon_request(self, method, **params):
+        if self.__daemon is None:
+            return None
+
+        try:
+            return self.__daemon.request(method, **params)
+        except (OSError, ValueError, DaemonError):
+            self.__daemon = None
+            return None
+
+    def aheadBehindCache(self):
+        if self.__aheadBehindCache is None:
+            self.__aheadBehindCache = AheadBehindCache(os.path.join(self.__paths.common_dir, AHEAD_BEHIND_CACHE))
+
+        return self.__aheadBehindCache
+
+    def close(self):
+        self.processes.close()
+
+    def _git_stream(self, *args):
+        command = ['git'] + list(args)
+        with trace.span(_command_name(args), 'git', argv=command) as details:
+            process = subprocess.Popen(command, cwd=self.working_tree_dir, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            completed = False
+            try:
+                yield from _nul_records(process.stdout)
+                completed = True
+            finally:
+                process.stdout.close()
+                if not completed:
+                    process.kill()
+                stderr = process.stderr.read()
+                process.stderr.close()
+                returncode = process.wait()
+                details['exit_code'] = returncode
+
+        if returncode != 0:
+            raise git.GitCommandError(command, returncode, stderr)
+
+    def _git(self, *args, input=None, exit_codes=(0,)):
+        command = ['git'] + list(args)
+        with trace.span(_command_name(args), 'git', argv=command) as details:
+            result = subprocess.run(command, cwd=self.working_tree_dir, input=input, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            details['exit_code'] = result.returncode
+
+        if result.returncode not in exit_codes:
+            raise git.GitCommandError(command, result.returncode, result.stderr)
+
+        return result.stdout
+
+    def _git_with_pathspecs(self, args, files):
+        pathspecs = b'\0'.join(os.fsencode(file.get_relative_path()) for file in files)
+        return self._git('--literal-pathspecs', *args, '--pathspec-from-file=-', '--pathspec-file-nul', input=pathspecs)
 
     def getDirectory(self):
         return self.__directory
@@ -56,91 +257,526 @@ class Repository:
         return self.repo.active_branch
 
     def active_branch_name(self):
-        return self.active_branch().name
+        return branch_name(self.__head.read())
+
+    def headSha(self):
+        return self.__head.sha(self.processes.resolve)
+
+    def commitTime(self, sha):
+        result = self.processes.read_object(sha)
+        if result is None or result[0] != 'commit':
+            return None
+
+        for line in result[1].split(b'\n'):
+            if line.startswith(b'committer '):
+                return int(line.rsplit(b' ', 2)[1])
+            if not line:
+                break
+
+        return None
+
+    @trace.traced('getBranches', 'repository')
+    def getBranches(self, local=True, remotes=False, withDiffs=True):
+        patterns = []
+        if local:
+            patterns.append('refs/heads')
+        if remotes:
+            patterns.append('refs/remotes')
+        if not patterns:
+            return []
+
+        records = self._daemon_request('branches', local=local, remotes=remotes, withDiffs=withDiffs)
+        if records is not None:
+            return [Branch.from_record(self, record) for record in records]
+
+        branches = []
+        shas = {}
+        for refname, sha, upstreamRefname in self.refs(patterns):
+            branches.append(Branch(self, refname, upstreamRefname or None, sha))
+            shas[refname] = sha
+
+        # upstreams inside the listed namespaces are free, everything else is resolved on demand
+        for branch in branches:
+            if branch.pending:
+                branch.upstreamSha = shas.get(branch.upstreamRefname)
+
+        if withDiffs:
+            self.materialize(branches)
+
+        return branches
+
+    def resolveUpstreams(self, branches):
+        for branch in branches:
+            if branch.upstreamRefname and branch.upstreamSha is None:
+                branch.upstreamSha = self.processes.resolve(branch.upstreamRefname)
+
+    def materialize(self, branches):
+        branches = [branch for branch in branches if branch.pending]
+        self.resolveUpstreams(branches)
+
+        pending = []
+        for branch in branches:
+            diff = self.aheadBehindCache().get(branch.sha, branch.upstreamSha) if branch.upstreamSha else (None, None)
+            if diff:
+                branch.setDiff(*diff)
+            else:
+                pending.append(branch)
+
+        if pending:
+            diffs = self.aheadBehind(pending)
+            for branch in pending:
+                branch.setDiff(*diffs.get(branch.refname, (None, None)))
+
+    def refs(self, patterns):
+        refs = read_refs(self.common_dir, patterns)
+        if refs is None:
+            output = self._git('for-each-ref', '--format=' + BRANCH_FORMAT, *patterns).decode()
+            return [tuple(line.split('\0')) for line in output.splitlines()]
+
+        upstreams = self.upstreams()
+        return [(refname, sha, upstreams.get(refname)) for refname, sha in refs]
+
+    def upstreams(self):
+        try:
+            output = self._git('config', '-z', '--get-regexp', UPSTREAM_CONFIG, exit_codes=CONFIG_EXIT_CODES).decode()
+        except git.GitCommandError:
+            return {}
+
+        return parse_upstreams(output)
+
+    @trace.traced('aheadBehind', 'repository')
+    def aheadBehind(self, branches):
+        wanted = {branch.refname: branch for branch in branches}
+        result = {}
+        output = self._git('for-each-ref', '--format=' + TRACK_FORMAT, *wanted.keys()).decode()
+        for line in output.splitlines():
+            refname, sha, upstreamRefname, track = line.split('\0')
+            branch = wanted.get(refname)
+            if not branch:
+                continue
+
+            diff = parseTrack(track)
+            result[refname] = diff
+            if branch.sha != sha or not branch.upstreamSha or upstreamRefname != branch.upstreamRefname or diff == (None, None):
+                continue
+
+            # a fetch may have moved the upstream since it was resolved, the counts are only cached for the pair they belong to
+            if self.processes.resolve(upstreamRefname) == branch.upstreamSha:
+                self.aheadBehindCache().put(sha, branch.upstreamSha, *diff)
+
+        self.aheadBehindCache().save()
+        return result
 
-    def getBranches(self, local=True, remotes=False):
-        refs = []
-        for ref in self.repo.refs:
-            if isinstance(ref, RemoteReference):
-                if remotes:
-                    refs.append(ref)
-            elif isinstance(ref, Head):
-                if local:
-                    refs.append(ref)
+    def reference(self, refname):
+        if refname.startswith(REMOTES_PREFIX):
+            return git.RemoteReference(self.repo, refname)
 
-        return [ Branch(ref, self.repo) for ref in refs ]
+        return git.Head(self.repo, refname)
 
     def remotes(self):
         return self.repo.remotes
 
-    def fetch(self):
-        for remote in self.repo.remotes:
-            remote.fetch()
+    def remoteNames(self):
+        return self._git('remote').decode().split()
+
+    def checkoutBranch(self, branch):
+        if branch.remote:
+            self._git('checkout', '--detach', branch.refname)
+        else:
+            self._git('checkout', branch.head)
+
+    def deleteBranch(self, name):
+        return self._git('branch', '-d', name).decode()
+
+    def fetchRemotes(self, names, jobs=FETCH_JOBS, onFailure=None):
+        # separate fetch processes would overwrite each other's FETCH_HEAD and compete for the ref locks
+        command = ['git', 'fetch', '--quiet', '--multiple', '--jobs={}'.format(jobs)] + list(names)
+        with trace.span('git fetch', 'git', argv=command) as details:
+            process = subprocess.Popen(command, cwd=self.working_tree_dir, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            # git reports a failed remote as soon as its fetch exits, successful ones only finish with the whole command
+            stderr = []
+            for line in process.stderr:
+                stderr.append(line)
+                if onFailure is not None:
+                    for name in failedRemotes(line.decode(errors='replace')):
+                        onFailure(name)
+            process.stderr.close()
+            returncode = process.wait()
+            details['exit_code'] = returncode
+
+        if returncode != 0:
+            raise git.GitCommandError(command, returncode, b''.join(stderr))
+
+    def fetch(self, jobs=FETCH_JOBS):
+        names = self.remoteNames()
+        if names:
+            self.fetchRemotes(names, jobs)
 
     def hasDetachedHead(self):
-        return self.repo.head.is_detached
+        refname, _ = self.__head.read()
+        return refname is None
+
+def failedRemotes(stderr):
+    return FAILED_FETCH.findall(stderr)
+
+
+def parseTrack(track):
+    if track == 'gone':
+        return (None, None)
+
+    ahead = 0
+    behind = 0
+    for part in track.split(', '):
+        if part.startswith('ahead '):
+            ahead = int(part[len('ahead '):])
+        elif part.startswith('behind '):
+            behind = int(part[len('behind '):])
+
+    return (ahead, behind)
+
 
 class Branch:
 
-    def __init__(self, reference, repo):
+    __slots__ = (
+        '__repository', 'refname', 'head', 'remote', 'sortKey', 'sha', 'upstream', 'upstreamRefname', 'upstreamSha',
+        'commitsAhead', 'commitsBehind', 'pending'
+    )
+
+    def __init__(self, repository, refname, upstreamRefname=None, sha=None):
         super().__init__()
-        self.head = reference.remote_head if isinstance(reference, RemoteReference) else reference.name
-        self.remote = reference.remote_name if isinstance(reference, RemoteReference) else None
-        self.reference = reference
+        if refname.startswith(REMOTES_PREFIX):
+            remote, self.head = refname[len(REMOTES_PREFIX):].split('/', 1)
+            self.remote = sys.intern(remote)
+        else:
+            self.remote = None
+            self.head = refname[len(HEADS_PREFIX):]
+
+        self.refname = refname
+        self.sortKey = (self.head, self.remote or '')
+        self.__repository = repository
+        self.sha = sha
+        self.upstreamSha = None
         self.commitsBehind = None
         self.commitsAhead = None
-        self.upstream = reference.tracking_branch()
-
-        if self.upstream:
-            commitsBehind = repo.iter_commits('{}..{}'.format(self.head, self.upstream))
-            self.commitsBehind = sum(1 for c in commitsBehind)
+        self.upstreamRefname = upstreamRefname
+        self.upstream = short_refname(upstreamRefname) if upstreamRefname else None
+        self.pending = upstreamRefname is not None
 
-            commitsAhead = repo.iter_commits('{}..{}'.format(self.upstream, self.head))
-            self.commitsAhead = sum(1 for c in commitsAhead)
+    @property
+    def reference(self):
+        return self.__repository.reference(self.refname)
 
-        self.diff = ''
+    @property
+    def diff(self):
+        diff = ''
         if self.commitsAhead:
-            self.diff += '↑·{}'.format(self.commitsAhead)
+            diff += '↑·{}'.format(self.commitsAhead)
 
         if self.commitsBehind:
-            self.diff += '↓·{}'.format(self.commitsBehind)
+            diff += '↓·{}'.format(self.commitsBehind)
+
+        return diff
+
+    def setDiff(self, commitsAhead, commitsBehind):
+        self.commitsAhead = commitsAhead
+        self.commitsBehind = commitsBehind
+        self.pending = False
+
+    def to_record(self):
+        return {
+            'refname': self.refname,
+            'upstreamRefname': self.upstreamRefname,
+            'sha': self.sha,
+            'upstreamSha': self.upstreamSha,
+            'commitsAhead': self.commitsAhead,
+            'commitsBehind': self.commitsBehind,
+            'pending': self.pending
+        }
+
+    def from_record(repository, record):
+        branch = Branch(repository, record['refname'], record['upstreamRefname'], record['sha'])
+        branch.upstreamSha = record['upstreamSha']
+        if not record['pending']:
+            branch.setDiff(record['commitsAhead'], record['commitsBehind'])
+
+        return branch
 
     def __repr__(self):
         diff = ', diff={}'.format(self.diff) if self.diff and len(self.diff) else ''
         return '<Branch head={}, remote={}, upstream={}{} >'.format(self.head, self.remote, self.upstream, diff)
 
 
-class Stage(Repository):
+def fsmonitor_daemon_supported():
+    output = subprocess.run(['git', 'version', '--build-options'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout
+    return b'fsmonitor--daemon' in output
 
-    def __init__(self, directory):
-        super().__init__(directory)
 
-    def status(self):
-        result = self.__staged_files() + self.__unstaged_files() + self.__untracked_files()
-        result.sort(key= lambda file: file.get_relative_path())
-        return result
+class StatusScan:
+
+    def __init__(self, stage):
+        super().__init__()
+        self.__runs = ([], [])
+        self.__merged = (0, 0, 0)
+        self.__overlays = []
+        self.__error = None
+        self.__cancelled = False
+        self.__threads = []
+
+        records = stage._daemon_request('status')
+        if records is not None:
+            self.__runs[0].extend(File.from_record(record) for record in records)
+            for patch in stage.expansions(directory_rows(self.__runs[0])):
+                self.overlay(*patch)
+            return
+
+        if UNTRACKED_CACHE in stage.accelerations():
+            # only status consults the untracked cache; a single run lists the tracked entries before the
+            # untracked ones, so both halves share one index refresh instead of racing for index.lock
+            sources = [(stage._git_stream(*STATUS_COMMAND), File.from_porcelain)]
+        else:
+            # the tracked changes are usually ready long before git has walked the untracked tree
+            sources = [
+                (stage._git_stream(*TRACKED_STATUS_COMMAND), File.from_porcelain),
+                (stage._git_stream(*UNTRACKED_DIRECTORIES_COMMAND), lambda paths: map(File.untracked_file, paths))
+            ]
+        for source in sources:
+            # directory rows are untracked, so only the source listing the untracked files expands them
+            expand = source is sources[-1]
+            thread = threading.Thread(target=self.__collect, args=(stage,) + source + (expand,), daemon=True)
+            thread.start()
+            self.__threads.append(thread)
+
+    def __collect(self, stage, records, to_files, expand):
+        try:
+            for file in to_files(records):
+                if self.__cancelled:
+                    return
+                self.__runs[0 if file.is_tracked() else 1].append(file)
+
+            if not expand:
+                return
+
+            for patch in stage.expansions(directory_rows(self.__runs[1])):
+                if self.__cancelled:
+                    return
+                self.overlay(*patch)
+        except git.GitCommandError as e:
+            self.__error = e
+        finally:
+            records.close()
 
-    def __staged_files(self):
-        return [File.from_diff(diff, True) for diff in self.repo.index.diff(self.repo.head.commit)]
+    def __state(self):
+        return tuple(len(run) for run in self.__runs) + (len(self.__overlays),)
 
-    def __unstaged_files(self):
-        return [File.from_diff(diff, False) for diff in self.repo.index.diff(None)]
+    def is_running(self):
+        if self.__cancelled:
+            return False
 
-    def __untracked_files(self):
-        return [File.untracked_file(f) for f in self.repo.untracked_files]
+        return any(thread.is_alive() for thread in self.__threads) or self.__state() != self.__merged
+
+    def overlay(self, paths, updates):
+        self.__overlays.append((paths, updates))
+
+    def poll(self):
+        if self.__error is not None:
+            raise self.__error
+
+        finished = not any(thread.is_alive() for thread in self.__threads)
+        state = self.__state()
+        if state == self.__merged:
+            return None
+
+        # merging is linear in the number of files, so it only happens once the list doubled
+        merged = sum(self.__merged[:2])
+        if not finished and merged >= FIRST_SCREEN_ROWS and sum(state[:2]) < 2 * merged:
+            return None
+
+        self.__merged = state
+        tracked, untracked = (run[:count] for run, count in zip(self.__runs, state))
+        files = list(heapq.merge(tracked, untracked, key=File.get_sort_key))
+        for paths, updates in self.__overlays[:state[2]]:
+            patch_status(files, paths, updates)
+
+        return files
+
+    def cancel(self):
+        self.__cancelled = True
+
+
+class Stage(Repository):
+
+    def __init__(self, directory, daemon=False):
+        super().__init__(directory, daemon)
+        self.__expanded = set()
+        self.__accelerations = None
+
+    @trace.traced('status', 'repository')
+    def status(self, paths=None):
+        if paths is None:
+            records = self._daemon_request('status')
+            if records is not None:
+                files = [File.from_record(record) for record in records]
+                self.__apply_expansions(files)
+                return files
+
+        command = STATUS_COMMAND
+        if paths is not None:
+            command = ['--literal-pathspecs'] + STATUS_COMMAND + ['--'] + list(paths)
+
+        tracked = []
+        untracked = []
+        for file in File.from_porcelain(self._git_stream(*command)):
+            if file.is_tracked():
+                tracked.append(file)
+            else:
+                untracked.append(file)
+
+        # git lists tracked entries and untracked files as two runs, each sorted by path
+        files = list(heapq.merge(tracked, untracked, key=File.get_sort_key))
+        if paths is None:
+            self.__apply_expansions(files)
+
+        return files
+
+    def scan(self):
+        return StatusScan(self)
+
+    def stream_status(self, all_untracked=False):
+        if all_untracked:
+            # the daemon and the default status collapse untracked directories into a single entry
+            return File.from_porcelain(self._git_stream(*ALL_UNTRACKED_STATUS_COMMAND))
+
+        records = self._daemon_request('status')
+        if records is not None:
+            return (File.from_record(record) for record in records)
+
+        return File.from_porcelain(self._git_stream(*STATUS_COMMAND))
+
+    def accelerations(self):
+        if self.__accelerations is not None:
+            return self.__accelerations
+
+        try:
+            output = self._git('config', '-z', '--get-regexp', ACCELERATION_CONFIG, exit_codes=CONFIG_EXIT_CODES).decode()
+        except git.GitCommandError:
+            output = ''
+
+        config = {}
+        for entry in output.split('\0'):
+            if entry:
+                key, _, value = entry.partition('\n')
+                config[key] = value.lower() or 'true'
+
+        self.__accelerations = []
+        many_files = config.get('feature.manyfiles') in TRUE_VALUES
+        untracked_cache = config.get('core.untrackedcache', 'true' if many_files else 'keep')
+        # 'keep' leaves an untracked cache that was added with update-index in place
+        if untracked_cache in TRUE_VALUES or (untracked_cache == 'keep' and index_has_extension(self.git_dir, UNTRACKED_CACHE_EXTENSION)):
+            self.__accelerations.append(UNTRACKED_CACHE)
+        if config.get('core.fsmonitor', 'false') not in FALSE_VALUES:
+            self.__accelerations.append(FSMONITOR)
+        if config.get('core.splitindex') in TRUE_VALUES:
+            self.__accelerations.append(SPLIT_INDEX)
+
+        return self.__accelerations
+
+    def enable_accelerations(self):
+        self._git('config', 'core.untrackedCache', 'true')
+        self._git('config', 'core.splitIndex', 'true')
+        if fsmonitor_daemon_supported():
+            self._git('config', 'core.fsmonitor', 'true')
+
+        self._git('update-index', '--untracked-cache', '--split-index')
+        # the first status after enabling them fills the untracked cache and writes the shared index
+        self._git(*STATUS_COMMAND)
+
+        self.__accelerations = None
+        return self.accelerations()
+
+    def expand(self, directory):
+        self.__expanded.add(directory)
+
+    def collapse(self, directory):
+        self.__expanded = {expanded for expanded in self.__expanded if not expanded.startswith(directory)}
+
+    def expanded_directory(self, path):
+        for directory in sorted(self.__expanded, key=len, reverse=True):
+            if path.startswith(directory):
+                return directory
+
+        return None
+
+    def directory_status(self, directory):
+        # the expansion replaces every row below the directory, so the index entries under it (e.g. a staged
+        # deletion of a file that is untracked now) are listed along with the untracked children
+        tracked = File.from_porcelain(self._git_stream('--literal-pathspecs', *TRACKED_STATUS_COMMAND, '--', directory))
+
+        # one walk over the untracked files is grouped into the direct children instead of passing every child as a pathspec
+        rows = set()
+        for path in self._git_stream('--literal-pathspecs', *UNTRACKED_FILES_COMMAND, '--', directory):
+            child, separator, _ = path[len(directory):].partition('/')
+            if child:
+                rows.add(directory + child + separator)
+        untracked = sorted(map(File.untracked_file, rows), key=File.get_sort_key)
+
+        return list(heapq.merge(tracked, untracked, key=File.get_sort_key))
+
+    def expansions(self, directories):
+        directories = set(directories)
+        for directory in sorted(self.__expanded):
+            if directory not in directories:
+                continue
+
+            updates = self.directory_status(directory)
+            directories.update(directory_rows(updates))
+            yield [directory], updates
+
+    def __apply_expansions(self, files):
+        patches = list(self.expansions(directory_rows(files)))
+        for patch in patches:
+            patch_status(files, *patch)
+
+        return patches
+
+    def count_untracked(self, directory):
+        return sum(1 for _ in self._git_stream('--literal-pathspecs', *UNTRACKED_FILES_COMMAND, '--', directory))
+
+    def update_status(self, files, paths):
+        paths = collapsed_paths(files, paths)
+        patches = [(paths, self.status(paths))]
+        patch_status(files, *patches[0])
+        return patches + self.__apply_expansions(files)
+
+    def ignored_directories(self):
+        records = self._git_stream('ls-files', '-z', '--others', '--ignored', '--exclude-standard', '--directory')
+        return [path for path in records if path.endswith('/')]
+
+    def is_ignored(self, path):
+        command = ['git', 'check-ignore', '-q', '--', path]
+        with trace.span('git check-ignore', 'git', argv=command) as details:
+            details['exit_code'] = subprocess.call(command, cwd=self.working_tree_dir)
+
+        return details['exit_code'] == 0
+
+    def watch(self):
+        return Watcher(self.working_tree_dir, self.git_dir, self.common_dir, self.ignored_directories(), self.is_ignored)
 
     def stash_all(self):
-        self.repo.git.stash()
+        self._git('stash')
 
     def pop_stash(self):
-        self.repo.git.stash('pop')
+        self._git('stash', 'pop')
 
     def ignore(self, untracked_file):
-        gitignore_path = self.repo.working_tree_dir + '/.gitignore'
-        gitignore_file = open(gitignore_path, 'a')
+        gitignore_path = self.working_tree_dir + '/.gitignore'
+        gitignore_file = open(gitignore_path, 'a+')
 
         try:
-            gitignore_file.write(untracked_file.get_relative_path())
+            gitignore_file.seek(0)
+            content = gitignore_file.read()
+            if content and not content.endswith('\n'):
+                gitignore_file.write('\n')
+            gitignore_file.write(untracked_file.get_relative_path() + '\n')
         finally:
             gitignore_file.close()
 
@@ -148,17 +784,27 @@ class Stage(Repository):
         if file.is_staged():
             self.reset(file)
 
-        self.repo.git.checkout(file.get_relative_path())
+        self._git('--literal-pathspecs', 'checkout', '--', file.get_relative_path())
+
+    def clean(self, untracked_file):
+        self._git('--literal-pathspecs', 'clean', '-f', '-d', '-q', '--', untracked_file.get_relative_path())
 
     def add(self, file):
-        self.repo.git.add(file.get_relative_path())
+        self.add_files([file])
+
+    def add_files(self, files):
+        self._git_with_pathspecs(['add'], files)
 
     def add_all(self):
-        self.repo.git.add('-A')
+        self._git('add', '-A')
 
     def reset(self, file):
-        subprocess.Popen('git reset HEAD -- ' + file.get_relative_path(), shell=True).wait()
+        self.reset_files([file])
+
+    # without an explicit HEAD, reset also unstages files on an unborn branch
+    def reset_files(self, files):
+        self._git_with_pathspecs(['reset', '-q'], files)
 
     def reset_all(self):
-        self.repo.git.reset('HEAD')
+        self._git('reset', '-q')
 
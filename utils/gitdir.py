@@ -0,0 +1,177 @@
+import mmap
+import os
+
+GIT_FILE = '.git'
+GITDIR_PREFIX = 'gitdir:'
+SYMBOLIC_REF_PREFIX = 'ref:'
+HEADS_PREFIX = 'refs/heads/'
+INDEX_FILE = 'index'
+INDEX_HASH_SIZES = (20, 32)
+
+
+class NotARepositoryError(Exception):
+    pass
+
+
+class RepositoryPaths:
+
+    def __init__(self, working_tree_dir, git_dir, common_dir):
+        super().__init__()
+        self.working_tree_dir = working_tree_dir
+        self.git_dir = git_dir
+        self.common_dir = common_dir
+
+
+def _read_first_line(path):
+    with open(path) as file:
+        return file.readline().strip()
+
+
+def _resolve_git_file(directory, path):
+    line = _read_first_line(path)
+    if not line.startswith(GITDIR_PREFIX):
+        raise NotARepositoryError('Invalid gitfile format: {}'.format(path))
+
+    return os.path.normpath(os.path.join(directory, line[len(GITDIR_PREFIX):].strip()))
+
+
+def _common_dir(git_dir):
+    commondir_path = os.path.join(git_dir, 'commondir')
+    if os.path.isfile(commondir_path):
+        return os.path.normpath(os.path.join(git_dir, _read_first_line(commondir_path)))
+
+    return git_dir
+
+
+def find_repository(directory):
+    directory = os.path.abspath(directory)
+    while True:
+        candidate = os.path.join(directory, GIT_FILE)
+        if os.path.isdir(candidate):
+            git_dir = candidate
+        elif os.path.isfile(candidate):
+            git_dir = _resolve_git_file(directory, candidate)
+        else:
+            parent = os.path.dirname(directory)
+            if parent == directory:
+                raise NotARepositoryError('not a git repository (or any of the parent directories)')
+            directory = parent
+            continue
+
+        return RepositoryPaths(directory, git_dir, _common_dir(git_dir))
+
+
+def read_head(git_dir):
+    head = _read_first_line(os.path.join(git_dir, 'HEAD'))
+    if head.startswith(SYMBOLIC_REF_PREFIX):
+        return (head[len(SYMBOLIC_REF_PREFIX):].strip(), None)
+
+    return (None, head)
+
+
+def branch_name(head):
+    refname, _ = head
+    if refname is None:
+        raise TypeError('HEAD is a detached symbolic reference as it points to a commit')
+
+    return refname[len(HEADS_PREFIX):] if refname.startswith(HEADS_PREFIX) else refname
+
+
+def active_branch_name(git_dir):
+    return branch_name(read_head(git_dir))
+
+
+def _stat_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+class HeadCache:
+
+    def __init__(self, git_dir, common_dir):
+        super().__init__()
+        self.__git_dir = git_dir
+        self.__common_dir = common_dir
+        self.__signature = None
+        self.__head = None
+        self.__sha_signature = None
+        self.__sha = None
+
+    def read(self):
+        # HEAD is rewritten by renaming a lock file over it, so every change shows up as a new inode or mtime
+        signature = _stat_signature(os.path.join(self.__git_dir, 'HEAD'))
+        if signature is None or signature != self.__signature:
+            self.__head = read_head(self.__git_dir)
+            self.__signature = signature
+
+        return self.__head
+
+    def sha(self, resolve):
+        refname, sha = self.read()
+        if refname is None:
+            return sha
+
+        signature = (
+            self.__signature,
+            _stat_signature(os.path.join(self.__common_dir, refname)),
+            _stat_signature(os.path.join(self.__common_dir, 'packed-refs'))
+        )
+        if signature != self.__sha_signature:
+            self.__sha = resolve(refname)
+            self.__sha_signature = signature
+
+        return self.__sha
+
+
+def refs_signature(git_dir, common_dir):
+    signature = [
+        _stat_signature(os.path.join(git_dir, 'HEAD')),
+        _stat_signature(os.path.join(common_dir, 'packed-refs')),
+        _stat_signature(os.path.join(common_dir, 'config'))
+    ]
+
+    # refs are replaced by renaming a lock file, which updates the mtime of the containing directory
+    for directory, _, _ in os.walk(os.path.join(common_dir, 'refs')):
+        signature.append((directory, _stat_signature(directory)))
+
+    return tuple(signature)
+
+
+def _extensions_end_at_hash(data, position):
+    while position + 8 <= len(data):
+        if not data[position:position + 4].isalpha():
+            return False
+
+        position += 8 + int.from_bytes(data[position + 4:position + 8], 'big')
+        if len(data) - position in INDEX_HASH_SIZES:
+            return True
+
+    return False
+
+
+def index_has_extension(git_dir, signature):
+    try:
+        file = open(os.path.join(git_dir, INDEX_FILE), 'rb')
+    except FileNotFoundError:
+        return False
+
+    with file:
+        try:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return False
+
+        with data:
+            # parsing every entry is too slow for large indexes, so a match only counts if it starts
+            # a chain of extension headers that ends right before the trailing checksum
+            position = data.find(signature)
+            while position >= 0:
+                if _extensions_end_at_hash(data, position):
+                    return True
+                position = data.find(signature, position + 1)
+
+    return False
@@ -0,0 +1,5 @@
+def pending_keys(window, key):
+    window.timeout(0)
+    while key != -1:
+        yield key
+        key = window.getch()
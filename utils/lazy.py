@@ -0,0 +1,19 @@
+import importlib
+import types
+
+
+class LazyModule(types.ModuleType):
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.__module = None
+
+    def __getattr__(self, attribute):
+        if self.__module is None:
+            self.__module = importlib.import_module(self.__name__)
+
+        return getattr(self.__module, attribute)
+
+
+def lazy_import(name):
+    return LazyModule(name)
@@ -0,0 +1,20 @@
+import json
+import sys
+
+
+def write_records(records, ndjson, stream=sys.stdout):
+    if ndjson:
+        for record in records:
+            stream.write(json.dumps(record) + '\n')
+            stream.flush()
+        return
+
+    # a JSON array with one record per line, so that it can still be consumed while it is written
+    stream.write('[')
+    separator = '\n'
+    for record in records:
+        stream.write(separator + json.dumps(record))
+        stream.flush()
+        separator = ',\n'
+    stream.write('\n]\n')
+    stream.flush()
@@ -0,0 +1,103 @@
+import subprocess
+import threading
+
+from utils import trace
+
+BATCH = '--batch'
+BATCH_CHECK = '--batch-check'
+
+
+class BatchChannel:
+
+    def __init__(self, cwd, mode):
+        super().__init__()
+        self.__command = ['git', 'cat-file', mode]
+        self.__cwd = cwd
+        self.__mode = mode
+        self.__process = None
+        self.__lock = threading.Lock()
+
+    def __start(self):
+        if self.__process is None or self.__process.poll() is not None:
+            self.__process = subprocess.Popen(
+                self.__command, cwd=self.__cwd,
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+            )
+
+        return self.__process
+
+    def __request(self, name):
+        process = self.__start()
+        process.stdin.write(name.encode() + b'\n')
+        process.stdin.flush()
+
+        header = process.stdout.readline()
+        if not header:
+            raise BrokenPipeError('git cat-file exited unexpectedly')
+
+        fields = header.decode().split()
+        if len(fields) != 3:
+            return None
+
+        sha, object_type, size = fields
+        data = None
+        if self.__mode == BATCH:
+            data = process.stdout.read(int(size))
+            process.stdout.read(1)
+
+        return (sha, object_type, int(size), data)
+
+    def request(self, name):
+        if '\n' in name:
+            return None
+
+        with self.__lock, trace.span(' '.join(self.__command), 'git.batch', object=name):
+            try:
+                return self.__request(name)
+            except BrokenPipeError:
+                self.__close()
+                return self.__request(name)
+
+    def __close(self):
+        if self.__process is None:
+            return
+
+        try:
+            self.__process.stdin.close()
+        except BrokenPipeError:
+            pass
+
+        try:
+            self.__process.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            self.__process.kill()
+            self.__process.wait()
+
+        self.__process.stdout.close()
+        self.__process = None
+
+    def close(self):
+        with self.__lock:
+            self.__close()
+
+
+class GitProcesses:
+
+    def __init__(self, cwd):
+        super().__init__()
+        self.__channels = {
+            BATCH_CHECK: BatchChannel(cwd, BATCH_CHECK),
+            BATCH: BatchChannel(cwd, BATCH)
+        }
+
+    def resolve(self, name):
+        result = self.__channels[BATCH_CHECK].request(name)
+        return result[0] if result else None
+
+    def read_object(self, name):
+        result = self.__channels[BATCH].request(name)
+        return (result[1], result[3]) if result else None
+
+    def close(self):
+        for channel in self.__channels.values():
+            channel.close()
@@ -0,0 +1,149 @@
+import mmap
+import os
+
+from utils.gitdir import SYMBOLIC_REF_PREFIX, HEADS_PREFIX
+
+PACKED_REFS = 'packed-refs'
+PACKED_REFS_HEADER = b'# pack-refs with:'
+REFTABLE = 'reftable'
+REMOTES_PREFIX = 'refs/remotes/'
+UPSTREAM_CONFIG = r'^(branch\..*\.(remote|merge)|remote\..*\.fetch)$'
+
+
+def _packed_refs(common_dir, prefix):
+    try:
+        file = open(os.path.join(common_dir, PACKED_REFS), 'rb')
+    except FileNotFoundError:
+        return
+
+    with file:
+        try:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return
+
+        with data:
+            start = 0
+            ordered = False
+            if data[:len(PACKED_REFS_HEADER)] == PACKED_REFS_HEADER:
+                start = data.find(b'\n') + 1
+                ordered = b'sorted' in data[:start].split()
+
+            prefix = os.fsencode(prefix)
+            if ordered:
+                # refs sharing a prefix form one contiguous block of a sorted file
+                position = data.find(b' ' + prefix, start)
+                if position < 0:
+                    return
+                start = data.rfind(b'\n', 0, position) + 1
+
+            while start < len(data):
+                end = data.find(b'\n', start)
+                if end < 0:
+                    end = len(data)
+
+                line = data[start:end]
+                start = end + 1
+                if line[:1] in (b'#', b'^') or not line:
+                    continue
+
+                sha, _, refname = line.partition(b' ')
+                if refname.startswith(prefix):
+                    yield os.fsdecode(refname), sha.decode()
+                elif ordered and refname > prefix:
+                    return
+
+
+def _loose_refs(common_dir, prefix):
+    for directory, _, names in os.walk(os.path.join(common_dir, prefix)):
+        for name in names:
+            if name.endswith('.lock'):
+                continue
+
+            path = os.path.join(directory, name)
+            try:
+                with open(path) as file:
+                    content = file.read().strip()
+            except (FileNotFoundError, UnicodeDecodeError):
+                continue
+
+            yield os.path.relpath(path, common_dir).replace(os.sep, '/'), content
+
+
+def read_refs(common_dir, prefixes):
+    if os.path.isdir(os.path.join(common_dir, REFTABLE)):
+        return None
+
+    refs = {}
+    symbolic = {}
+    for prefix in prefixes:
+        prefix = prefix.rstrip('/') + '/'
+        refs.update(_packed_refs(common_dir, prefix))
+        for refname, content in _loose_refs(common_dir, prefix):
+            if content.startswith(SYMBOLIC_REF_PREFIX):
+                symbolic[refname] = content[len(SYMBOLIC_REF_PREFIX):].strip()
+            else:
+                refs[refname] = content
+
+    for refname, target in symbolic.items():
+        if target in refs:
+            refs[refname] = refs[target]
+
+    return sorted(refs.items())
+
+
+def _apply_refspec(refspec, refname):
+    if refspec.startswith('^'):
+        return None
+
+    source, _, destination = refspec.lstrip('+').partition(':')
+    if '*' not in source:
+        return destination if source == refname and destination else None
+
+    head, _, tail = source.partition('*')
+    if not refname.startswith(head) or not refname.endswith(tail) or len(refname) < len(head) + len(tail):
+        return None
+
+    return destination.replace('*', refname[len(head):len(refname) - len(tail)], 1)
+
+
+def parse_upstreams(config):
+    remotes = {}
+    merges = {}
+    refspecs = {}
+    for entry in config.split('\0'):
+        key, _, value = entry.partition('\n')
+        section, _, rest = key.partition('.')
+        name, _, variable = rest.rpartition('.')
+        if section == 'branch' and variable == 'remote':
+            remotes[name] = value
+        elif section == 'branch' and variable == 'merge':
+            merges[name] = value if value.startswith('refs/') else HEADS_PREFIX + value
+        elif section == 'remote' and variable == 'fetch':
+            refspecs.setdefault(name, []).append(value)
+
+    upstreams = {}
+    for name, merge in merges.items():
+        remote = remotes.get(name)
+        if remote is None:
+            continue
+
+        if remote == '.':
+            upstreams[HEADS_PREFIX + name] = merge
+            continue
+
+        for refspec in refspecs.get(remote, []):
+            upstream = _apply_refspec(refspec, merge)
+            if upstream:
+                upstreams[HEADS_PREFIX + name] = upstream
+                break
+
+    return upstreams
+
+
+def short_refname(refname):
+    for prefix in (HEADS_PREFIX, REMOTES_PREFIX):
+        if refname.startswith(prefix):
+            return refname[len(prefix):]
+
+    return refname
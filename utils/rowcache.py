@@ -0,0 +1,31 @@
+from collections import OrderedDict
+
+CAPACITY = 512
+
+
+class RowCache:
+
+    def __init__(self, capacity=CAPACITY):
+        super().__init__()
+        self.__capacity = capacity
+        self.__rows = OrderedDict()
+        self.__width = None
+
+    def get(self, key, width, build):
+        if width != self.__width:
+            self.__rows.clear()
+            self.__width = width
+
+        row = self.__rows.get(key)
+        if row is None:
+            row = build()
+            self.__rows[key] = row
+            if len(self.__rows) > self.__capacity:
+                self.__rows.popitem(last=False)
+        else:
+            self.__rows.move_to_end(key)
+
+        return row
+
+    def clear(self):
+        self.__rows.clear()
@@ -0,0 +1,83 @@
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+_tracer = None
+
+
+class Tracer:
+
+    def __init__(self, path):
+        super().__init__()
+        self.__path = path
+        self.__events = []
+        self.__lock = threading.Lock()
+        self.__pid = os.getpid()
+        self.__origin = time.perf_counter()
+
+    def __timestamp(self, seconds):
+        return (seconds - self.__origin) * 1000000
+
+    @contextmanager
+    def span(self, name, category, args):
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            end = time.perf_counter()
+            event = {
+                'name': name,
+                'cat': category,
+                'ph': 'X',
+                'ts': self.__timestamp(start),
+                'dur': self.__timestamp(end) - self.__timestamp(start),
+                'pid': self.__pid,
+                'tid': threading.get_ident(),
+                'args': args
+            }
+            with self.__lock:
+                self.__events.append(event)
+
+    def save(self):
+        with self.__lock:
+            events = list(self.__events)
+
+        with open(self.__path, 'w') as file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file, default=str)
+
+
+@contextmanager
+def _disabled(args):
+    yield args
+
+
+def enable(path):
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer(path)
+        atexit.register(_tracer.save)
+
+    return _tracer
+
+
+def span(name, category, **args):
+    if _tracer is None:
+        return _disabled(args)
+
+    return _tracer.span(name, category, args)
+
+
+def traced(name, category):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name, category):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,198 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+import time
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WORKTREE_EVENTS = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+GIT_DIR_EVENTS = IN_CLOSE_WRITE | IN_MOVED_TO | IN_ONLYDIR
+
+EVENT_HEADER = struct.Struct('iIII')
+DEBOUNCE_INTERVAL = 0.15
+READ_SIZE = 65536
+
+INDEX_FILE = 'index'
+IGNORE_FILE = '.gitignore'
+INFO_DIRECTORY = 'info'
+EXCLUDE_FILE = 'exclude'
+
+
+class Watcher:
+
+    def __init__(self, working_tree_dir, git_dir, common_dir, ignored_directories, is_ignored):
+        super().__init__()
+        self.__libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.__fd = self.__libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.__fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+
+        self.__working_tree_dir = working_tree_dir
+        self.__ignored = {os.path.join(working_tree_dir, directory.rstrip('/')) for directory in ignored_directories}
+        self.__is_ignored = is_ignored
+        self.__directories = {}
+        self.__changed_paths = set()
+        self.__full_refresh = False
+        self.__index_changed = False
+        self.__last_event = None
+
+        self.__git_dir_watch = self.__add_watch(git_dir, GIT_DIR_EVENTS)
+        self.__info_watch = self.__add_watch(os.path.join(common_dir, INFO_DIRECTORY), GIT_DIR_EVENTS)
+        self.__watch_tree(working_tree_dir)
+
+    def fileno(self):
+        return self.__fd
+
+    def close(self):
+        if self.__fd >= 0:
+            os.close(self.__fd)
+            self.__fd = -1
+
+    def __add_watch(self, path, mask):
+        return self.__libc.inotify_add_watch(self.__fd, os.fsencode(path), mask)
+
+    def __watch_tree(self, top):
+        git_dir = os.path.join(self.__working_tree_dir, '.git')
+        for directory, subdirectories, _ in os.walk(top):
+            subdirectories[:] = [
+                name for name in subdirectories
+                if os.path.join(directory, name) not in self.__ignored and os.path.join(directory, name) != git_dir
+            ]
+
+            descriptor = self.__add_watch(directory, WORKTREE_EVENTS)
+            if descriptor >= 0:
+                self.__directories[descriptor] = os.path.relpath(directory, self.__working_tree_dir)
+
+    def __unwatch_tree(self, top):
+        # a moved directory keeps its watch descriptors, which would report events under the old path
+        prefix = top + '/'
+        for descriptor, directory in list(self.__directories.items()):
+            if directory == top or directory.startswith(prefix):
+                del self.__directories[descriptor]
+                self.__libc.inotify_rm_watch(self.__fd, descriptor)
+
+    def __read_events(self):
+        while True:
+            try:
+                data = os.read(self.__fd, READ_SIZE)
+            except BlockingIOError:
+                return
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+
+            offset = 0
+            while offset < len(data):
+                descriptor, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                self.__handle_event(descriptor, mask, name)
+
+            self.__last_event = time.monotonic()
+
+    def __handle_event(self, descriptor, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            self.__full_refresh = True
+            return
+
+        if descriptor == self.__git_dir_watch:
+            if name == INDEX_FILE:
+                self.__index_changed = True
+            return
+
+        if descriptor == self.__info_watch:
+            if name == EXCLUDE_FILE:
+                self.__full_refresh = True
+            return
+
+        directory = self.__directories.get(descriptor)
+        if directory is None:
+            return
+
+        if mask & (IN_IGNORED | IN_DELETE_SELF):
+            if mask & IN_IGNORED:
+                del self.__directories[descriptor]
+            return
+
+        if mask & IN_MOVE_SELF:
+            # the move itself is reported by the parent, unless the parent is not watched
+            self.__unwatch_tree(directory)
+            return
+
+        path = name if directory == '.' else directory + '/' + name
+        if name == IGNORE_FILE:
+            self.__full_refresh = True
+
+        if mask & IN_ISDIR and mask & IN_MOVED_FROM:
+            self.__unwatch_tree(path)
+
+        if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+            if self.__is_ignored(path):
+                self.__ignored.add(os.path.join(self.__working_tree_dir, path))
+                return
+
+            self.__watch_tree(os.path.join(self.__working_tree_dir, path))
+
+        self.__changed_paths.add(path)
+
+    def discard(self):
+        self.__read_events()
+        self.__changed_paths = set()
+        self.__full_refresh = False
+        self.__index_changed = False
+        self.__last_event = None
+
+    def discard_index_changes(self):
+        self.__read_events()
+        self.__index_changed = False
+
+    def discard_paths(self, paths):
+        # only the paths that were just queried again are up to date, other pending changes are kept
+        self.discard_index_changes()
+        directories = tuple(path.rstrip('/') + '/' for path in paths)
+        self.__changed_paths = {
+            path for path in self.__changed_paths
+            if not (path + '/').startswith(directories)
+        }
+        if not self.__changed_paths and not self.__full_refresh:
+            self.__last_event = None
+
+    def __take_changes(self):
+        changes = (sorted(self.__changed_paths), self.__full_refresh or self.__index_changed)
+        self.__changed_paths = set()
+        self.__full_refresh = False
+        self.__index_changed = False
+        self.__last_event = None
+        return changes
+
+    def poll(self):
+        self.__read_events()
+        if self.__last_event is None or time.monotonic() - self.__last_event < DEBOUNCE_INTERVAL:
+            return None
+
+        return self.__take_changes()
+
+    def flush(self):
+        self.__read_events()
+        if self.__last_event is None:
+            return None
+
+        return self.__take_changes()
@@ -0,0 +1,133 @@
+import os
+import queue
+from multiprocessing import Pool
+
+from utils.gitdir import GIT_FILE
+from utils.git import Stage
+
+DISCOVERY_DEPTH = 4
+SKIPPED_DIRECTORIES = ('node_modules', '__pycache__')
+
+
+def discover_repositories(root, depth=DISCOVERY_DEPTH):
+    try:
+        entries = sorted(os.scandir(root), key=lambda entry: entry.name)
+    except (PermissionError, FileNotFoundError, NotADirectoryError):
+        return
+
+    if any(entry.name == GIT_FILE for entry in entries):
+        # nested repositories and submodules are reached through the repository containing them
+        yield root
+        return
+
+    if depth == 0:
+        return
+
+    for entry in entries:
+        if entry.name.startswith('.') or entry.name in SKIPPED_DIRECTORIES:
+            continue
+        if entry.is_dir(follow_symlinks=False):
+            yield from discover_repositories(entry.path, depth - 1)
+
+
+def empty_summary(directory):
+    return {
+        'path': directory,
+        'branch': None,
+        'staged': 0,
+        'modified': 0,
+        'untracked': 0,
+        'ahead': None,
+        'behind': None,
+        'unpushed': 0,
+        'outdated': 0,
+        'error': None
+    }
+
+
+def summarize(directory):
+    summary = empty_summary(directory)
+    stage = Stage(directory, daemon=True)
+    try:
+        # untracked files are counted one by one, just like stage lists them once a directory is expanded
+        for file in stage.stream_status(all_untracked=True):
+            if not file.is_tracked():
+                summary['untracked'] += 1
+            elif file.is_staged():
+                summary['staged'] += 1
+            else:
+                summary['modified'] += 1
+
+        summary['branch'] = None if stage.hasDetachedHead() else stage.active_branch_name()
+        for branch in stage.getBranches(local=True, remotes=False, withDiffs=True):
+            if branch.commitsAhead:
+                summary['unpushed'] += 1
+            if branch.commitsBehind:
+                summary['outdated'] += 1
+            if branch.head == summary['branch']:
+                summary['ahead'] = branch.commitsAhead
+                summary['behind'] = branch.commitsBehind
+    finally:
+        stage.close()
+
+    return summary
+
+
+def failed_summary(directory, error):
+    summary = empty_summary(directory)
+    summary['error'] = str(error).strip() or type(error).__name__
+    return summary
+
+
+def is_dirty(summary):
+    return bool(summary['staged'] or summary['modified'] or summary['untracked'])
+
+
+class WorkspaceScan:
+
+    def __init__(self, directories, jobs=None):
+        super().__init__()
+        # status and for-each-ref are mostly cpu bound in git itself, so every core gets its own repository.
+        # the workers of a multiprocessing pool are daemonic and can be terminated, so quitting never waits for a scan
+        self.__pool = Pool(processes=jobs or os.cpu_count() or 1)
+        self.__pending = set()
+        self.__finished = queue.Queue()
+        for directory in directories:
+            self.rescan(directory)
+
+    def rescan(self, directory):
+        if directory in self.__pending:
+            return
+
+        self.__pending.add(directory)
+        self.__pool.apply_async(
+            summarize, (directory,),
+            callback=self.__finished.put,
+            error_callback=lambda error: self.__finished.put(failed_summary(directory, error))
+        )
+
+    def __take(self, summary):
+        self.__pending.discard(summary['path'])
+        return summary
+
+    def pending(self):
+        return len(self.__pending)
+
+    def is_running(self):
+        return len(self.__pending) > 0
+
+    def poll(self):
+        summaries = []
+        while True:
+            try:
+                summaries.append(self.__take(self.__finished.get_nowait()))
+            except queue.Empty:
+                return summaries
+
+    def results(self):
+        while self.__pending:
+            yield self.__take(self.__finished.get())
+
+    def cancel(self):
+        self.__pending.clear()
+        self.__pool.terminate()
@@ -0,0 +1,323 @@
+import curses
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from gupy.geometry import Padding
+from gupy.screen import ConstrainedBasedScreen
+from gupy.view import ListView, Label, HBox, BackgroundView
+from utils.input import pending_keys
+from utils.output import write_records
+from utils.rowcache import RowCache
+from utils.workspace import discover_repositories, is_dirty, WorkspaceScan
+from utils import trace
+
+BASE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+STAGE_SCRIPT = os.path.join(BASE_DIRECTORY, 'stage.py')
+BRANCHES_SCRIPT = os.path.join(BASE_DIRECTORY, 'branches.py')
+
+KEY_ENTER=ord('\n')
+KEY_B=ord('b')
+KEY_S=ord('s')
+KEY_O=ord('o')
+KEY_R=ord('r')
+KEY_Q=ord('q')
+
+SCAN_INTERVAL=100
+PLACEHOLDER='…'
+
+COLOR_PAIR_TITLE=1
+COLOR_PAIR_KEY=2
+COLOR_PAIR_DESCRIPTION=3
+COLOR_PAIR_BRANCH=4
+COLOR_PAIR_SELECTED=5
+COLOR_PAIR_CHANGES=6
+COLOR_PAIR_DIFF=7
+COLOR_PAIR_ERROR=8
+COLOR_PAIR_SCANNING=9
+
+LEGEND=[
+    ('[ENTER]', ' Stage '),
+    ('[B]', ' Branches '),
+    ('[S]', ' Sort by next column '),
+    ('[O]', ' Reverse order '),
+    ('[R]', ' Rescan '),
+    ('[Q]', ' Quit ')
+]
+
+SORT_CHANGES='changes'
+SORT_UNPUSHED='unpushed'
+
+# every column puts the repositories that need attention first
+SORT_COLUMNS=[
+    ('repository', lambda summary: 0),
+    ('branch', lambda summary: summary['branch'] or ''),
+    (SORT_CHANGES, lambda summary: -(summary['staged'] + summary['modified'] + summary['untracked'])),
+    ('ahead', lambda summary: -(summary['ahead'] or 0)),
+    ('behind', lambda summary: -(summary['behind'] or 0)),
+    (SORT_UNPUSHED, lambda summary: -summary['unpushed'])
+]
+
+
+def shorten_path(path):
+    try:
+        return '~/' + str(Path(path).relative_to(Path.home()))
+    except ValueError:
+        return str(path)
+
+
+def changes_text(summary):
+    return '+{} ~{} ?{}'.format(summary['staged'], summary['modified'], summary['untracked'])
+
+
+def diff_text(summary):
+    if summary['ahead'] is None and summary['behind'] is None:
+        return ''
+
+    return '↑{} ↓{}'.format(summary['ahead'] or 0, summary['behind'] or 0)
+
+
+class WorkspaceDelegate:
+
+    def __init__(self, root, directories, sort_column=SORT_CHANGES):
+        self.root = root
+        self.directories = directories
+        self.summaries = {}
+        self.names = {directory: os.path.relpath(directory, root) for directory in directories}
+        self.name_width = max([len(name) for name in self.names.values()], default=0)
+        self.sort_index = [name for name, _ in SORT_COLUMNS].index(sort_column)
+        self.descending = False
+        self.rows = []
+        self.row_cache = RowCache()
+        self.sort()
+
+    def sort_column(self):
+        return SORT_COLUMNS[self.sort_index][0]
+
+    def next_sort_column(self):
+        self.sort_index = (self.sort_index + 1) % len(SORT_COLUMNS)
+        self.sort()
+
+    def reverse(self):
+        self.descending = not self.descending
+        self.sort()
+
+    def sort(self):
+        _, column = SORT_COLUMNS[self.sort_index]
+
+        scanned = [directory for directory in self.directories if directory in self.summaries]
+        pending = [directory for directory in self.directories if directory not in self.summaries]
+        scanned.sort(key=lambda directory: (column(self.summaries[directory]), self.names[directory]), reverse=self.descending)
+        self.rows = scanned + sorted(pending, key=self.names.get)
+
+    def update(self, summaries):
+        for summary in summaries:
+            self.summaries[summary['path']] = summary
+        self.sort()
+
+    def number_of_rows(self):
+        return len(self.rows)
+
+    def get_data(self, i):
+        return self.rows[i]
+
+    def build_row(self, i, directory, is_selected, width):
+        summary = self.summaries.get(directory)
+        key = (directory, summary and tuple(summary.values()), is_selected)
+        return self.row_cache.get(key, width, lambda: self.make_row(directory, summary, is_selected))
+
+    def make_row(self, directory, summary, is_selected):
+        hbox = HBox()
+
+        name_label = Label(self.names[directory].ljust(self.name_width))
+        name_label.attributes.append(curses.A_BOLD)
+        hbox.add_view(name_label, Padding(2, 0, 0, 0))
+
+        if summary is None:
+            hbox.add_view(Label(PLACEHOLDER), Padding(2, 0, 0, 0))
+
+        elif summary['error'] is not None:
+            error_label = Label('✗ ' + summary['error'].splitlines()[0])
+            error_label.attributes.append(curses.color_pair(COLOR_PAIR_ERROR))
+            hbox.add_view(error_label, Padding(2, 0, 0, 0))
+
+        else:
+            branch_label = Label('[{}]'.format(summary['branch'] or 'detached HEAD'))
+            branch_label.attributes.append(curses.color_pair(COLOR_PAIR_BRANCH))
+            hbox.add_view(branch_label, Padding(2, 0, 0, 0))
+
+            changes_label = Label(changes_text(summary))
+            if is_dirty(summary):
+                changes_label.attributes.append(curses.color_pair(COLOR_PAIR_CHANGES))
+                changes_label.attributes.append(curses.A_BOLD)
+            hbox.add_view(changes_label, Padding(2, 0, 0, 0))
+
+            diff_label = Label(diff_text(summary))
+            diff_label.attributes.append(curses.color_pair(COLOR_PAIR_DIFF))
+            diff_label.attributes.append(curses.A_BOLD)
+            hbox.add_view(diff_label, Padding(2, 0, 0, 0))
+
+            if summary['unpushed']:
+                hbox.add_view(Label('{} unpushed'.format(summary['unpushed'])), Padding(2, 0, 0, 0))
+
+        result = hbox
+        if is_selected:
+            result = BackgroundView(curses.color_pair(COLOR_PAIR_SELECTED))
+            result.add_view(hbox)
+            for label in hbox.get_elements():
+                label.attributes.append(curses.color_pair(COLOR_PAIR_SELECTED))
+
+        return result
+
+
+def open_repository(stdscr, script, directory):
+    curses.def_prog_mode()
+    curses.endwin()
+    with trace.span('open', 'ui', script=os.path.basename(script), path=directory):
+        subprocess.call([sys.executable, script], cwd=directory)
+    curses.reset_prog_mode()
+    stdscr.clear()
+
+
+def main(stdscr, root, directories, sort_column):
+    scan = WorkspaceScan(directories)
+
+    curses.curs_set(0)
+    curses.init_pair(COLOR_PAIR_TITLE, curses.COLOR_BLACK, curses.COLOR_WHITE)
+    curses.init_pair(COLOR_PAIR_KEY, curses.COLOR_BLACK, curses.COLOR_CYAN)
+    curses.init_pair(COLOR_PAIR_DESCRIPTION, curses.COLOR_BLACK, curses.COLOR_WHITE)
+    curses.init_pair(COLOR_PAIR_BRANCH, curses.COLOR_MAGENTA, curses.COLOR_BLACK)
+    curses.init_pair(COLOR_PAIR_SELECTED, curses.COLOR_BLACK, curses.COLOR_CYAN)
+    curses.init_pair(COLOR_PAIR_CHANGES, curses.COLOR_YELLOW, curses.COLOR_BLACK)
+    curses.init_pair(COLOR_PAIR_DIFF, curses.COLOR_MAGENTA, curses.COLOR_BLACK)
+    curses.init_pair(COLOR_PAIR_ERROR, curses.COLOR_RED, curses.COLOR_BLACK)
+    curses.init_pair(COLOR_PAIR_SCANNING, curses.COLOR_BLUE, curses.COLOR_WHITE)
+
+    screen = ConstrainedBasedScreen(stdscr)
+    title_background = BackgroundView(curses.color_pair(COLOR_PAIR_TITLE))
+    screen.add_view(title_background, lambda w, h, v: (0, 0, w, 1))
+
+    root_label = Label(shorten_path(root))
+    root_label.attributes.append(curses.color_pair(COLOR_PAIR_TITLE))
+    root_label.attributes.append(curses.A_BOLD)
+
+    sort_label = Label()
+    sort_label.attributes.append(curses.color_pair(COLOR_PAIR_TITLE))
+
+    scanning_label = Label()
+    scanning_label.attributes.append(curses.color_pair(COLOR_PAIR_SCANNING))
+
+    title_hbox = HBox()
+    title_hbox.add_view(root_label, Padding(0, 0, 0, 0))
+    title_hbox.add_view(sort_label, Padding(1, 0, 0, 0))
+    title_hbox.add_view(scanning_label, Padding(1, 0, 0, 0))
+    screen.add_view(title_hbox, lambda w, h, v: ((w-v.required_size().width)//2, 0, title_hbox.required_size().width+1, 1))
+
+    more_label = Label('')
+    legend_hbox = HBox()
+    def set_more_label(clipped):
+        more_label.text = '...' if clipped else ''
+
+    legend_hbox.clipping_callback = set_more_label
+    for key, description in LEGEND:
+        key_label = Label(key)
+        key_label.attributes.append(curses.color_pair(COLOR_PAIR_KEY))
+        legend_hbox.add_view(key_label, Padding(2, 0, 0, 0))
+
+        description_label = Label(description)
+        description_label.attributes.append(curses.color_pair(COLOR_PAIR_DESCRIPTION))
+        legend_hbox.add_view(description_label, Padding(0, 0, 0, 0))
+
+    screen.add_view(legend_hbox, lambda w, h, v: (0, h-1, w-more_label.required_size().width, 1))
+    screen.add_view(more_label, lambda  w, h, v: (w-v.required_size().width-1, h-1, v.required_size().width, 1))
+
+    delegate = WorkspaceDelegate(root, directories, sort_column)
+    list_view = ListView(delegate, delegate)
+    screen.add_view(list_view, lambda w, h, v: (0, 1, w, h-2))
+
+    dirty = True
+    while 1:
+        summaries = scan.poll()
+        if summaries:
+            delegate.update(summaries)
+            dirty = True
+
+        title_texts = (
+            '(by {}{})'.format(delegate.sort_column(), ', reversed' if delegate.descending else ''),
+            '[scanning {} of {}]'.format(scan.pending(), len(directories)) if scan.is_running() else ''
+        )
+        if (sort_label.text, scanning_label.text) != title_texts:
+            sort_label.text, scanning_label.text = title_texts
+            dirty = True
+
+        if dirty:
+            with trace.span('render', 'ui'):
+                screen.render()
+            dirty = False
+
+        # slow repositories only fill in their rows, they never hold back the keyboard
+        stdscr.timeout(SCAN_INTERVAL if scan.is_running() else -1)
+        key = stdscr.getch()
+
+        for key in pending_keys(stdscr, key):
+            dirty = True
+            with trace.span('input', 'ui', key=key):
+                directory = delegate.get_data(list_view.get_selected_row_index()) if delegate.number_of_rows() > 0 else None
+
+                if key == KEY_Q:
+                    scan.cancel()
+                    return
+
+                elif key == curses.KEY_UP:
+                    list_view.select_previous()
+
+                elif key == curses.KEY_DOWN:
+                    list_view.select_next()
+
+                elif key == KEY_ENTER and directory:
+                    open_repository(stdscr, STAGE_SCRIPT, directory)
+                    scan.rescan(directory)
+
+                elif key == KEY_B and directory:
+                    open_repository(stdscr, BRANCHES_SCRIPT, directory)
+                    scan.rescan(directory)
+
+                elif key == KEY_S:
+                    delegate.next_sort_column()
+
+                elif key == KEY_O:
+                    delegate.reverse()
+
+                elif key == KEY_R:
+                    # the previous rows stay visible until their repository has been scanned again
+                    for path in directories:
+                        scan.rescan(path)
+
+
+def print_workspace(root, ndjson, is_failing):
+    failing = False
+
+    def records():
+        nonlocal failing
+        for summary in scan.results():
+            failing = failing or is_failing(summary)
+            yield summary
+
+    scan = WorkspaceScan(list(discover_repositories(os.path.abspath(root))))
+    try:
+        write_records(records(), ndjson)
+    finally:
+        scan.cancel()
+    return 1 if failing else 0
+
+
+def run_workspace(root, sort_column):
+    root = os.path.abspath(root)
+    directories = list(discover_repositories(root))
+    if not directories:
+        print('No git repositories found below \'{}\'.'.format(shorten_path(root)), file=sys.stderr)
+        return 1
+
+    curses.wrapper(main, root, directories, sort_column)
+    return 0